@@ -1,11 +1,14 @@
 from urllib.parse import urlparse
 
 from src.database.adapter import load_db_adapter
+from src.modules.url_canonicalizer import URLCanonicalizer
 from src.services import BacklinkService, IPService
+from src.utils import config
 
 adapter = load_db_adapter()
 backlink_service = BacklinkService(adapter)
 ip_service = IPService(adapter)
+url_canonicalizer = URLCanonicalizer(config.crawler)
 
 
 def _get_base_url(url: str) -> str:
@@ -29,13 +32,18 @@ def _is_same_subbdomain(url1: str, url2: str) -> bool:
 print("Initial backlink count:", backlink_service.count())
 
 
+# domains stored before they were keyed by their canonical origin
+normalized = ip_service.normalize_domains(url_canonicalizer.origin)
+if normalized:
+    ip_service.commit(verbose=False)
+    print("Normalized IP domains:", normalized)
+
 ip_service.remove_duplicates()
 
 # clear the scores before updating to
 # avoid adding to existing scores
-for ip_obj in ip_service.get_ips():
-    ip_obj.score = 0
-    ip_service.update_ip(ip_obj)
+for ip_row in ip_service.get_ips():
+    ip_service.update_ip(ip_service.to_object(ip_row._replace(score=0)))
 
 # update ip scores based on backlinks
 for backlink in backlink_service.get_backlinks():
@@ -45,7 +53,7 @@ for backlink in backlink_service.get_backlinks():
         continue
 
     base_source = _get_base_url(backlink.source_url)
-    base_target = _get_base_url(backlink.target_url)
+    base_target = url_canonicalizer.origin(backlink.target_url) or _get_base_url(backlink.target_url)
     
     ip_target_obj = ip_service.get_ip_by_domain(base_target)
     if not ip_target_obj:
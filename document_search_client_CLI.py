@@ -3,7 +3,8 @@ import threading
 
 from src.models import SearchResultTable
 from src.modules.crawler import Crawler
-from src.modules.pagerank import PageRank, adapter
+from src.database.adapter import load_db_adapter
+from src.modules.pagerank import PageRank
 from timeit import default_timer as timer
 from src.services.SearchResultService import SearchResultService
 from src.utils import config
@@ -21,7 +22,8 @@ def update_search_results(raw_query, ranks, doc_count, cache_hit):
     )
 
 
-search_result_service = SearchResultService(adapter)
+# the ranking adapter is read only, search results are written through their own one
+search_result_service = SearchResultService(load_db_adapter())
 crawler = Crawler(config.crawler)
 pr = PageRank()
 
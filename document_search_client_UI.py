@@ -7,7 +7,8 @@ import pyperclip
 
 from src.models import PageScore, SearchResultTable
 from src.modules.crawler import Crawler
-from src.modules.pagerank import PageRank, adapter
+from src.database.adapter import load_db_adapter
+from src.modules.pagerank import PageRank
 from timeit import default_timer as timer
 from src.services.SearchResultService import SearchResultService
 from src.utils import config
@@ -134,7 +135,8 @@ def search(lucky: bool = False):
 
 
 # Load services
-search_result_service = SearchResultService(adapter)
+# the ranking adapter is read only, search results are written through their own one
+search_result_service = SearchResultService(load_db_adapter())
 crawler = Crawler(config.crawler)
 pr = PageRank()
 
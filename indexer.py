@@ -1,29 +1,60 @@
 from src.database.adapter import load_db_adapter
 from src.modules.crawler import Crawler
-from src.services import PageService
+from src.modules.recrawl_scheduler import RecrawlScheduler
+from src.modules.simhash import simhash, visible_text
+from src.services import FingerprintService, PageService
 from src.services.DocumentIndexService import DocumentIndexService
 from src.utils import config
 
 adapter = load_db_adapter()
 page_service = PageService(adapter)
 document_index_service = DocumentIndexService(adapter)
+fingerprint_service = FingerprintService(adapter)
 
 print("Initial document index count:", document_index_service.count())
 
 crawler = Crawler(config.crawler)
+recrawl_scheduler = RecrawlScheduler(config.crawler)
 
-# clear the document index table
-document_index_service.delete_all_document_indices(commit=True)
+skipped = 0
+duplicates = 0
+# bodies are read one page at a time, and not at all for unchanged pages
+for page in page_service.get_pages(columns=("page_url", "content_hash", "indexed_hash")):
+    if page.content_hash and page.indexed_hash == page.content_hash:
+        # content did not change since the last indexer pass
+        skipped += 1
+        continue
 
-for page in page_service.get_pages():
-    if not page.body:
+    stored_body = page_service.get_page(page.page_url, columns=("body",))
+    if not stored_body or not stored_body.body:
         continue
-    if not isinstance(page.body, bytes):
+    if not isinstance(stored_body.body, bytes):
         raise ValueError("Page body is not bytes")
-    
-    content = page.body.decode("utf-8", errors="ignore")
-    document_frequency, word_details = crawler.get_document_frequency(content)
-    
+
+    body = page_service.get_body(stored_body)
+    content_hash = page.content_hash or RecrawlScheduler.hash_content(body)
+
+    content = body.decode("utf-8", errors="ignore")
+    # drop the indices of the previous version of the page
+    document_index_service.delete_document_indices_by_document_url(page.page_url)
+
+    fingerprint = simhash(visible_text(body)) if body.strip() else None
+    canonical_url = None
+    if fingerprint is not None:
+        clusters = fingerprint_service.fingerprint(page.page_url, fingerprint)
+        canonical_url = clusters.canonical_url
+        page_service.update_clusters(recrawl_scheduler, clusters.demoted, clusters.released)
+        for demoted_url in clusters.demoted:
+            # no longer searchable, its canonical page is
+            document_index_service.delete_document_indices_by_document_url(demoted_url)
+    if canonical_url:
+        # only the canonical page of a near-duplicate cluster is searchable
+        duplicates += 1
+        document_frequency = None
+        print(f"Skipped {page.page_url}, near-duplicate of {canonical_url}")
+    else:
+        document_frequency, word_details = crawler.get_document_frequency(content)
+
     if document_frequency:
         for word, freq in document_frequency.items():
             for location, tag in word_details[word]:
@@ -37,6 +68,11 @@ for page in page_service.get_pages():
                 )
                 document_index_service.add_document_index(document_index)
         print(f"Indexed {page.page_url}")
-        document_index_service.commit()
 
+    stored_page = page_service.get_page(page.page_url)
+    stored_page.content_hash = content_hash
+    stored_page.indexed_hash = content_hash
+    document_index_service.commit()
+
+print(f"Skipped {skipped} unchanged pages and {duplicates} near-duplicates.")
 print("Indexing complete. Total indices:", document_index_service.count())
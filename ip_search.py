@@ -1,25 +1,27 @@
 import json
+import multiprocessing
+import queue
 import random
 import socket
 import sys
 import os
-import threading
 import time
+from collections import defaultdict, deque
 
 from tqdm import tqdm
-import ipaddress
 
-from src.exceptions import InvalidResponse
-from src.models import Config
+from src.exceptions import InvalidResponse, ResponseRejected
+from src.models import ChunkStatus, Config
 from src.modules.crawler import Crawler
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import asyncio
 import aiohttp
-from src.utils import get_reserved_ips
+from src.utils import get_excluded_ranges
 from src.modules.response_converter import ResponseConverter
 from lxml.etree import ParserError
 from src.database.adapter import load_db_adapter
+from src.services import ChunkProgressService, LeaseService
 from src.services.IPService import IPService
 from sqlalchemy.exc import SQLAlchemyError
 from src.utils import config
@@ -27,10 +29,34 @@ from src.utils import config
 from src.modules.response_validator import ResponseValidator
 
 
-async def ip_scan_task(ip, ports, semaphore):
-    async with semaphore, aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=config.crawler.req_timeout)) as session:        
+async def is_port_open(ip, port, timeout) -> bool:
+    """Cheap TCP connect probe, used to avoid full HTTP requests to dead hosts."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+async def probe_ports(ip, ports, timeout) -> list[int]:
+    results = await asyncio.gather(*(is_port_open(ip, port, timeout) for port in ports))
+    return [port for port, is_open in zip(ports, results) if is_open]
+
+async def ip_scan_task(ip, ports):
+    # only promote addresses with an open port to the HTTP stage
+    open_ports = await probe_ports(ip, ports, config.crawler.probe_timeout)
+    if not open_ports:
+        return 0
+
+    hits = 0
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=config.crawler.req_timeout)) as session:        
         try:
-            for port in ports:
+            for port in open_ports:
                 is_https = port == 443
                 ip_template = "http{}://{}:{}"
                 full_url = ip_template.format("s" if is_https else "", ip, port)
@@ -39,8 +65,12 @@ async def ip_scan_task(ip, ports, semaphore):
                     "User-Agent": config.crawler.user_agent,
                 }
                 async with session.get(full_url, headers=headers) as response:
-                    response = await ResponseConverter.from_aiohttp(response)
-                    fails = validator.validate(response)
+                    try:
+                        response = await ResponseConverter.from_aiohttp(response, validator=header_validator)
+                    except ResponseRejected as e:
+                        print(f"❌ - {response.url} ({full_url}) [{response.status}] - {[fail.name for fail in e.fails]}")
+                        raise
+                    fails = validator.validate(response, headers_checked=config.crawler.header_prefilter)
                     if fails:
                         print(f"❌ - {response.url} ({full_url}) [{response.status_code}] - {[fail.name for fail in fails]}")
                         raise InvalidResponse("Response failed validation")
@@ -51,6 +81,7 @@ async def ip_scan_task(ip, ports, semaphore):
                             domain_name = f"http{'s' if is_https else ''}://{domain_name}"
                     except socket.herror:
                         domain_name = response.url if response.url != ip else f"http{'s' if is_https else ''}://{ip}"
+                    domain_name = crawler.origin(domain_name) or domain_name
 
                     obj = ip_service.generate_obj(
                         "domain",
@@ -59,8 +90,10 @@ async def ip_scan_task(ip, ports, semaphore):
                         port=port,
                         status=response.status_code,
                     )
-                    ip_service.upsert_ip(obj)
-                    print(f"✅ - ({domain_name}) - ({ip}:{port}) - [{response.status_code}] - added to the session to be committed.")
+                    # buffering may flush and back off while the database is locked, keep that off the event loop
+                    await ip_service.run(ip_service.buffer_upsert, obj)
+                    hits += 1
+                    print(f"✅ - ({domain_name}) - ({ip}:{port}) - [{response.status_code}] - added to the buffer to be written.")
                     
             # TODO handle exceptions
         except SQLAlchemyError as e:
@@ -86,115 +119,349 @@ async def ip_scan_task(ip, ports, semaphore):
             raise KeyboardInterrupt
         except Exception as e:
             print("CRITICAL ERROR:", e.__class__.__name__, e)
+    return hits
+
+def iter_chunk_ips(ip_ranges, start=0):
+    """Lazily yield (ordinal, address) for every address of a chunk that is not excluded,
+    starting at the `start`th address in chunk order."""
+    sizes = [end - begin for begin, end in ip_ranges]
+    total = sizes[0] * sizes[1] * sizes[2] * sizes[3]
+    for ordinal in range(start, total):
+        rest, d = divmod(ordinal, sizes[3])
+        rest, c = divmod(rest, sizes[2])
+        a, b = divmod(rest, sizes[1])
+        a, b, c, d = a + ip_ranges[0][0], b + ip_ranges[1][0], c + ip_ranges[2][0], d + ip_ranges[3][0]
+        if excluded_ranges.contains(a << 24 | b << 16 | c << 8 | d):
+            continue
+        yield ordinal, f"{a}.{b}.{c}.{d}"
+
+async def ip_range_scan_task(ip_ranges = ((0, 16), (0, 16), (0, 16), (0, 16)), ports = (80, 443), workers = 512,
+                             start = 0, checkpoint_interval = 1024, on_checkpoint = None) -> int:
+    """Scan a chunk with a fixed pool of workers fed through a bounded queue.
+
+    Only `workers` scans and at most `2 * workers` queued addresses exist at
+    any time, regardless of the chunk size.
+
+    The chunk is split into sub-chunks of `checkpoint_interval` addresses.
+    Whenever every sub-chunk up to some point has finished,
+    `on_checkpoint(scanned, hits)` is called with the number of addresses
+    scanned in chunk order and the hits found since the previous call, so an
+    interrupted scan can be resumed with `start=scanned`.
+    Returns the total number of hits.
+    """
+    queue = asyncio.Queue(maxsize=workers * 2)
+    progress = tqdm(desc=f"Scanning IPs for chunk {ip_ranges}", unit="ip")
 
-async def ip_range_scan_task(semaphore, ip_ranges = ((0, 16), (0, 16), (0, 16), (0, 16)), ports = (80, 443)):
-    tasks = []
-    for a in tqdm(range(ip_ranges[0][0], ip_ranges[0][1]), desc=f"Queueing IPs for chunk {ip_ranges}"):
-        for b in range(ip_ranges[1][0], ip_ranges[1][1]):
-            for c in range(ip_ranges[2][0], ip_ranges[2][1]):
-                for d in range(ip_ranges[3][0], ip_ranges[3][1]):
-                    ip = f"{a}.{b}.{c}.{d}"
-                    tasks.append(ip_scan_task(ip, ports=ports, semaphore=semaphore))
-    await asyncio.gather(*tasks)
+    total = 1
+    for begin, end in ip_ranges:
+        total *= end - begin
+    # addresses still in flight per sub-chunk, and hits not yet reported
+    pending = defaultdict(int)
+    closed = set()
+    state = {"watermark": start // checkpoint_interval, "hits": 0, "total_hits": 0}
+
+    def advance_checkpoint():
+        moved = False
+        while state["watermark"] in closed and not pending[state["watermark"]]:
+            closed.discard(state["watermark"])
+            pending.pop(state["watermark"], None)
+            state["watermark"] += 1
+            moved = True
+        if moved and on_checkpoint:
+            on_checkpoint(min(state["watermark"] * checkpoint_interval, total), state["hits"])
+            state["hits"] = 0
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                ordinal, ip = item
+                hits = await ip_scan_task(ip, ports=ports)
+                state["hits"] += hits
+                state["total_hits"] += hits
+                pending[ordinal // checkpoint_interval] -= 1
+                advance_checkpoint()
+                progress.update(1)
+            finally:
+                queue.task_done()
+
+    worker_tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        current = state["watermark"]
+        for ordinal, ip in iter_chunk_ips(ip_ranges, start=current * checkpoint_interval):
+            sub_chunk = ordinal // checkpoint_interval
+            while current < sub_chunk:
+                # every address of the previous sub-chunk is queued
+                closed.add(current)
+                current += 1
+            pending[sub_chunk] += 1
+            await queue.put((ordinal, ip))
+        # trailing sub-chunks the excluded ranges removed entirely have nothing
+        # to queue, close them too so the final checkpoint reaches `total`
+        closed.update(range(current, -(-total // checkpoint_interval)))
+        for _ in worker_tasks:
+            await queue.put(None)
+        await asyncio.gather(*worker_tasks)
+        advance_checkpoint()
+    finally:
+        for task in worker_tasks:
+            task.cancel()
+        progress.close()
+    return state["total_hits"]
+
+def _box_bounds(box: tuple[tuple[int, int], ...]) -> tuple[int, int]:
+    """Lowest and highest address of a chunk box. Missing trailing octets span 0-255."""
+    box = tuple(box) + ((0, 256),) * (4 - len(box))
+    low = high = 0
+    for start, end in box:
+        low = low << 8 | start
+        high = high << 8 | (end - 1)
+    return low, high
 
 def generate_ip_chunks(config:Config) -> list[tuple[tuple[int, int], tuple[int, int], tuple[int, int], tuple[int, int]]]:
     csize = config.crawler.chunk_size
     if csize > 256 or csize < 1 or 256 % csize != 0:
         raise ValueError("Invalid chunk size")
-    
-    reserved_ips = get_reserved_ips()
+
+    octets = [(start, start + csize) for start in range(0, 256, csize)]
+
+    def _generate(prefix: tuple[tuple[int, int], ...]):
+        low, high = _box_bounds(prefix)
+        # skip the whole subtree when an excluded range covers all of its addresses
+        if excluded_ranges.covers(low, high):
+            return
+        if len(prefix) == 4:
+            chunks.append(prefix)
+            return
+        if len(prefix) == 3 and not excluded_ranges.overlaps(low, high):
+            chunks.extend(prefix + (octet,) for octet in octets)
+            return
+        for octet in octets:
+            _generate(prefix + (octet,))
 
     chunks = []
-    for a in range(0, 256, csize):
-        for b in range(0, 256, csize):
-            for c in range(0, 256, csize):
-                for d in range(0, 256, csize):
-                    if ipaddress.IPv4Address(f"{a}.{b}.{c}.{d}") in reserved_ips:
-                        continue
-                    chunks.append(((a, a+csize), (b, b+csize), (c, c+csize), (d, d+csize)))
+    _generate(())
     
-    # distrubuting the chunks among n amount of scripts running in parallel
-    machines = config.system.total_machines
-    machine_id = config.system.machine_id
-    if machine_id >= machines:
-        raise ValueError("Invalid machine id")
-
-    # check if config is valid and no chunk is left out
-    if len(chunks) % machines != 0:
-        print("Warning: Chunk size is not divisible by total machines, trying to distribute chunks evenly")
-        remaining_chunks = len(chunks) % machines
-        # add remaining chunks to the last n machines
-        for i in range(remaining_chunks):
-            chunks[-(i+1)] = (chunks[-(i+1)],)
-        
-    responsible_chunks = [chunk for i, chunk in enumerate(chunks) if i % machines == machine_id]
+    # chunks are not assigned to machines up front, every machine walks all of
+    # them and leases the ones nobody else is working on (see process_chunks)
     print("Total chunks:", len(chunks))
-    print(f"Your Machine (Machine {machine_id}) is responsible for {len(responsible_chunks)} chunks and {len(responsible_chunks) * config.crawler.chunk_size ** 4} IPs")
-    
-    return responsible_chunks
+    return chunks
 
-def process_chunks(chunks):
-    for chunk in chunks:
-        try:
-            if stop_event.is_set():
-                raise KeyboardInterrupt
+def scan_chunk(chunk) -> tuple[str, int]:
+    """Lease, scan and record a single chunk. Returns the outcome and the number of hits."""
+    chunk_key = ChunkProgressService.chunk_key(chunk)
+    if not lease_service.claim_one("ip_chunk", chunk_key):
+        return "leased", 0
+    try:
+        progress = chunk_progress_service.get_progress(chunk)
+        if progress and progress.status == ChunkStatus.DONE.value:
+            # finished by another machine since startup
+            return "done", 0
+        progress = chunk_progress_service.start(chunk)
+        ip_service.commit(verbose=False)
+        if progress.checkpoint:
+            print(f"Resuming chunk {chunk} from address {progress.checkpoint}")
+        else:
             print("Processing chunk:", chunk)
-            semaphore = asyncio.Semaphore(config.crawler.max_workers.ip_search)
-            asyncio.run(ip_range_scan_task(semaphore, chunk, ports=config.crawler.ports))
-            print("IP scan complete for chunk")
-        except Exception as e:
-            print("CRITICAL ERROR:", e.__class__.__name__, e)
-            raise e
-        except KeyboardInterrupt:
-            print("Interrupted by user")
-            break
-        finally:
-            print("Committing changes...")
+
+        def on_checkpoint(scanned, hits):
+            # results of the scanned addresses are committed together with the checkpoint
+            chunk_progress_service.checkpoint(chunk, scanned, hits)
             ip_service.commit(verbose=False)
-            print("Total valid IPs:", len(ip_service.get_valid_ips()))
-            time.sleep(1)
+            if not lease_service.renew("ip_chunk", [chunk_key]):
+                print(f"Warning: lost the lease of chunk {chunk}")
+
+        hits = asyncio.run(ip_range_scan_task(
+            chunk,
+            ports=config.crawler.ports,
+            workers=config.crawler.max_workers.ip_search,
+            start=progress.checkpoint,
+            checkpoint_interval=config.crawler.checkpoint_interval,
+            on_checkpoint=on_checkpoint,
+        ))
+        chunk_progress_service.finish(chunk)
+        print("IP scan complete for chunk")
+        return "scanned", hits
+    finally:
+        print("Committing changes...")
+        ip_service.commit(verbose=False)
+        lease_service.release("ip_chunk", [chunk_key])
+
+
+def init_worker():
+    """Create the per-process database connection and services."""
+    global db_adapter, ip_service, chunk_progress_service, lease_service
+    db_adapter = load_db_adapter()
+    ip_service = IPService(db_adapter)
+    ip_service.enable_write_behind()
+    chunk_progress_service = ChunkProgressService(db_adapter)
+    lease_service = LeaseService(db_adapter)
+
+
+def chunk_worker(worker_id, work_queue, results_queue, stop_event):
+    """Worker process: takes chunks from the work queue until it gets None or is stopped."""
+    init_worker()
+    try:
+        while not stop_event.is_set():
+            chunk = work_queue.get()
+            if chunk is None or stop_event.is_set():
+                break
+            try:
+                outcome, hits = scan_chunk(chunk)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception as e:
+                print("CRITICAL ERROR:", e.__class__.__name__, e)
+                outcome, hits = "failed", 0
+            results_queue.put((worker_id, chunk, outcome, hits))
+    except KeyboardInterrupt:
+        print(f"Worker {worker_id} interrupted by user")
+    finally:
+        lease_service.release_all()
+        results_queue.put((worker_id, None, "exit", 0))
 
 
 validator = ResponseValidator()
+header_validator = validator if config.crawler.header_prefilter else None
 crawler = Crawler(config.crawler)
-db_adapter = load_db_adapter()
-ip_service = IPService(db_adapter)
-print("Initial ips:", len(ip_service.get_all()))
+excluded_ranges = get_excluded_ranges(config.crawler.ip_blocklist)
+
+# set per process by init_worker
+db_adapter = None
+ip_service = None
+chunk_progress_service = None
+lease_service = None
+
 
-print("Generating IP chunks...")
-chunks = generate_ip_chunks(config)
+def load_chunks():
+    print("Initial ips:", ip_service.count())
 
-if config.crawler.shuffle_chunks:
-    random.shuffle(chunks)
+    print("Generating IP chunks...")
+    chunks = generate_ip_chunks(config)
 
-stop_event = threading.Event()
+    if config.crawler.shuffle_chunks:
+        random.shuffle(chunks)
+
+    # resume: skip finished chunks and continue interrupted ones first
+    done_chunks = chunk_progress_service.get_chunk_keys_by_status(ChunkStatus.DONE)
+    in_progress_chunks = chunk_progress_service.get_chunk_keys_by_status(ChunkStatus.IN_PROGRESS)
+    chunks = [chunk for chunk in chunks if ChunkProgressService.chunk_key(chunk) not in done_chunks]
+    chunks.sort(key=lambda chunk: ChunkProgressService.chunk_key(chunk) not in in_progress_chunks)
+    print(f"Skipping {len(done_chunks)} finished chunks, resuming {len(in_progress_chunks)} interrupted chunks.")
+    return chunks
 
-parallelism = config.crawler.parallelism
-threads = []
-thread_chunk_size = len(chunks) // parallelism
 
 def run():
+    """Supervisor: feeds chunks to `parallelism` worker processes and collects their results.
+
+    Every worker has its own event loop, database connection and session, so
+    scanning scales with the number of cores instead of sharing one GIL.
+    """
+    init_worker()
+    chunks = load_chunks()
+    parallelism = config.crawler.parallelism
+
+    stop_event = multiprocessing.Event()
+    work_queue = multiprocessing.Queue(maxsize=parallelism * 2)
+    results_queue = multiprocessing.Queue()
+    workers = []
+    for i in range(parallelism):
+        p = multiprocessing.Process(
+            target=chunk_worker,
+            args=(i, work_queue, results_queue, stop_event),
+            name=f"ip-search-worker-{i}",
+        )
+        p.start()
+        print(f"Starting worker process {p.name} ({i+1}/{parallelism})")
+        workers.append(p)
+
     print("Starting IP scan...")
+    next_chunk = 0
+    # chunks leased by another machine, retried once that lease may have expired
+    leased = deque()
+    outstanding = 0  # chunks handed out whose outcome has not come back yet
+    sentinels_sent = 0
+    alive = parallelism
+    exited = set()
+    total_hits = 0
+    scanned = 0
     try:
-        for i in range(parallelism):
-            t = threading.Thread(
-                target=process_chunks,
-                args=(chunks[i*thread_chunk_size:(i+1)*thread_chunk_size],),
-                daemon=True
-            )
-            print(f"Starting thread {t.name} ({i+1}/{parallelism})")
-            t.start()
-            threads.append(t)
+        while alive:
+            # keep the bounded work queue topped up
+            while leased and leased[0][0] <= time.monotonic() and not stop_event.is_set():
+                try:
+                    work_queue.put_nowait(leased[0][1])
+                    leased.popleft()
+                    outstanding += 1
+                except queue.Full:
+                    break
+            while next_chunk < len(chunks) and not stop_event.is_set():
+                try:
+                    work_queue.put_nowait(chunks[next_chunk])
+                    next_chunk += 1
+                    outstanding += 1
+                except queue.Full:
+                    break
+            # any outstanding chunk may still come back leased and need a retry
+            finished = next_chunk >= len(chunks) and not leased and not outstanding
+            if (finished or stop_event.is_set()) and sentinels_sent < parallelism:
+                try:
+                    work_queue.put_nowait(None)
+                    sentinels_sent += 1
+                except queue.Full:
+                    pass
 
-        while not stop_event.is_set():
-            time.sleep(1)
+            try:
+                worker_id, chunk, outcome, hits = results_queue.get(timeout=1)
+            except queue.Empty:
+                if not any(p.is_alive() for p in workers):
+                    break
+                for worker_id, p in enumerate(workers):
+                    if worker_id not in exited and not p.is_alive() and results_queue.empty():
+                        # died without reporting, the chunk it held stays leased until the next run.
+                        # Results it queued may be lost with it, so stop waiting for outstanding ones
+                        print(f"Worker {p.name} died (exit code {p.exitcode})")
+                        exited.add(worker_id)
+                        alive -= 1
+                        outstanding = 0
+                continue
+            if outcome == "exit":
+                if worker_id not in exited:
+                    exited.add(worker_id)
+                    alive -= 1
+                continue
+            outstanding = max(outstanding - 1, 0)
+            if outcome == "scanned":
+                scanned += 1
+                total_hits += hits
+                print(f"Worker {worker_id} finished chunk {chunk} with {hits} hits ({scanned} chunks, {total_hits} hits so far)")
+            elif outcome == "failed":
+                print(f"Worker {worker_id} failed to scan chunk {chunk}")
+            elif outcome == "leased":
+                # the machine holding it may have crashed, its lease expires after the TTL
+                leased.append((time.monotonic() + config.system.lease_ttl_seconds, chunk))
 
     except (KeyboardInterrupt, SystemExit):
-        print('Received keyboard interrupt, safely quitting threads. Wait for threads to finish...')
+        print('Received keyboard interrupt, safely stopping workers. Wait for workers to finish...')
         stop_event.set()
+        for _ in workers:
+            try:
+                work_queue.put(None, timeout=1)
+            except queue.Full:
+                pass
 
-    for t in threads:
-        t.join()  # wait for all threads to finish
+    # keep draining results, a worker with unflushed queue data cannot exit
+    while any(p.is_alive() for p in workers):
+        try:
+            results_queue.get(timeout=1)
+        except (queue.Empty, KeyboardInterrupt):
+            pass
+    for p in workers:
+        p.join()  # wait for all workers to finish
+    lease_service.release_all()
+    print("Total valid IPs:", len(ip_service.get_valid_ips(columns=("domain",))))
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -1,29 +1,275 @@
 from datetime import datetime
 import random
+import time
+from typing import Optional
 import sys
 import os
 import threading
 
 
-from src.exceptions import InvalidResponse
-from src.models import BacklinkTable, IPTableBase, PageTableBase
-from src.services import BacklinkService, PageService, URLFrontierService
+from src.exceptions import InvalidResponse, ResponseRejected
+from src.models import BacklinkTable, IPTableBase, PageTableBase, URLFrontierTable
+from src.services import BacklinkService, FingerprintService, HostService, LeaseService, PageService, URLFrontierService
 from src.utils import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import asyncio
 import aiohttp
+from concurrent.futures.process import BrokenProcessPool
 from src.modules.response_converter import ResponseConverter
 from lxml.etree import ParserError
 from src.database.adapter import load_db_adapter
 from src.services.IPService import IPService
 from sqlalchemy.exc import SQLAlchemyError
 from src.models import LinkType
+from src.modules.crawl_pipeline import HostPacer, StageStats, create_parse_pool, iter_batches, parse_page
 from src.modules.crawler import Crawler
+from src.modules.recrawl_scheduler import RecrawlScheduler
 from src.modules.response_validator import ResponseValidator
 
 
-async def page_scan_task(obj: IPTableBase|PageTableBase, semaphore):
+def mark_crawled(obj: IPTableBase|PageTableBase, url: str, last_crawled: datetime):
+    """Write the crawl time of a claimed IP or page, stored pages of other urls do not carry it.
+
+    The claimed work is a transient copy of its row (see to_object), setting
+    last_crawled on it alone writes nothing.
+    """
+    obj.last_crawled = last_crawled
+    if isinstance(obj, IPTableBase):
+        ip_service.update_columns(obj.domain, last_crawled=last_crawled)
+    elif obj.page_url != url:
+        # redirected, the page itself is stored under the url it ended on
+        page_service.update_columns(obj.page_url, last_crawled=last_crawled)
+
+
+def mark_not_modified(obj: IPTableBase|PageTableBase, page_url: str, headers: dict) -> PageTableBase:
+    """Reschedule the stored page of a url that answered 304."""
+    known_page = page_service.get_page(page_url)
+    recrawl_scheduler.mark_not_modified(known_page, headers)
+    if fingerprint_service.get_canonical_url(page_url):
+        recrawl_scheduler.mark_duplicate(known_page)
+    mark_crawled(obj, page_url, known_page.last_crawled)
+    return known_page
+
+
+def mark_if_unchanged(url: str, response) -> tuple[Optional[PageTableBase], bool]:
+    """Return the stored page of a response, and whether its content is unchanged and it was rescheduled."""
+    stored_page = page_service.get_page(url)
+    if stored_page and not recrawl_scheduler.has_changed(stored_page, response.content_bytes):
+        recrawl_scheduler.mark_not_modified(stored_page, response.headers)
+        if fingerprint_service.get_canonical_url(url):
+            recrawl_scheduler.mark_duplicate(stored_page)
+        return stored_page, True
+    return stored_page, False
+
+
+def mark_disallowed(obj: IPTableBase|PageTableBase):
+    """Persist the crawl time of an IP or page robots.txt disallows, so it is not sampled again every round."""
+    if isinstance(obj, IPTableBase):
+        obj.last_crawled = datetime.now()
+        ip_service.update_columns(obj.domain, last_crawled=obj.last_crawled)
+        return
+    recrawl_scheduler.mark_disallowed(obj)
+    page_service.update_columns(
+        obj.page_url, last_crawled=obj.last_crawled, recrawl_interval=obj.recrawl_interval, next_crawl=obj.next_crawl
+    )
+
+
+def drop_fingerprint(url: str):
+    """Forget the fingerprint of a page that failed validation, its near-duplicates are crawled again."""
+    page_service.update_clusters(recrawl_scheduler, released=fingerprint_service.remove(url))
+
+
+def find_new_hosts(responses: list) -> dict:
+    """Map the hosts without a host row to the first (page url, response) of each."""
+    new_hosts = {}
+    for page_url, response in responses:
+        host = HostService.get_host_key(response.url)
+        if host not in new_hosts and not host_service.get_host(response.url):
+            new_hosts[host] = (page_url, response)
+    return new_hosts
+
+
+def fetch_host_artifacts(page_url: str, response) -> dict:
+    """Download the favicon, robots.txt and sitemap of the host of a response."""
+    return dict(
+        favicon=crawler.get_favicon(response),
+        robotstxt=crawler.get_robots_txt(page_url),
+        sitemap=crawler.get_sitemap(response),
+    )
+
+
+def store_page(page_url: str, url: str, response, meta_tags, links, stored_page: Optional[PageTableBase],
+               last_crawled: datetime, canonical_url: Optional[str] = None):
+    """Write a fetched page under its canonical url, and the links discovered on it.
+
+    A near-duplicate of `canonical_url` is stored without its body and its
+    links, and is only revisited after the longest recrawl interval.
+    """
+    page_obj = page_service.generate_obj(
+        "page_url",
+        page_url=url,
+        title=meta_tags.title,
+        status_code=response.status_code,
+        keywords=meta_tags.keywords,
+        description=meta_tags.description,
+        body=None if canonical_url else response.content_bytes,
+        last_crawled=last_crawled,
+    )
+    recrawl_scheduler.mark_changed(
+        page_obj,
+        response.headers,
+        previous=stored_page,
+        body=response.content_bytes,
+        now=last_crawled,
+    )
+    if canonical_url:
+        recrawl_scheduler.mark_duplicate(page_obj, now=last_crawled)
+        page_service.buffer_upsert(page_obj)
+        print(f"⏭️ - 🕷️ Page Crawl - {response.url} ({page_url}) - near-duplicate of {canonical_url}, body and links skipped.")
+        return
+    page_service.buffer_upsert(page_obj)
+    print(f"✅ - 🕷️ Page Crawl - {response.url} ({page_url}) - added to the page buffer to be written.")
+
+    if not links or not all([link.type == LinkType.INVALID for link in links]):
+        print(f"Discovering {len(links)} links...")
+        for link in links:
+            # deleting backlinks from the source to the target to
+            # prevent duplicates. It will be recreated later.
+            backlink_service.buffer_delete_by_source_to_target_url(page_url, link.url)
+        for link in links:
+            if link.type == LinkType.INTERNAL:
+                is_added = page_service.buffer_insert(
+                    page_service.generate_obj(
+                        "page_url",
+                        page_url=link.url,
+                        title=None,
+                        status_code=None,
+                        keywords=None,
+                        description=None,
+                        body=None,
+                        last_crawled=None,
+                    )
+                )
+                if is_added:
+                    print(f"✅ - ↩️ Internal Page Discover - ({link.url}) - added to the page buffer to be written.")
+                else:
+                    print(f"⚠️ - ↩️ Internal Page Discover - ({link.url}) - already buffered.")
+            elif link.type == LinkType.EXTERNAL:
+                target_ip = ip_service.get_ip_by_domain(crawler.origin(link.url) or link.url)
+                if not target_ip:
+                    # add new ip to URL frontier instead of directly adding to IP table
+                    # because we have not send a request to the IP to validate it yet.
+                    # we could, but it should not be the responsibility of the page scan task
+                    # existing frontier URLs are skipped when the buffer is written
+                    if url_frontier_service.buffer_insert(URLFrontierTable(url=link.url)):
+                        print(f"✅ - 🌐 External Page Discover - ({link.url}) - added to the URL frontier buffer.")
+                    else :
+                        print(f"⚠️ - 🌐 External Page Discover - ({link.url}) - already buffered for the URL frontier.")
+                backlink_service.buffer_insert(BacklinkTable(source_url=page_url, target_url=link.url, anchor_text=link.anchor_text))
+                print(f"✅ - 🔗 External Page Discover: Backlink - ({page_url}) -> ({link.url}) - added to the backlink buffer to be written.")
+    else:
+        print("No valid links found.")
+
+
+def store_batch(batch: list, host_artifacts: dict) -> int:
+    """Write a batch of parsed pages, each in its own unit of work. Returns the number that failed."""
+    failed = 0
+    for obj, page_url, response, parsed in batch:
+        # redirects may end on a non-canonical url, pages are keyed by the canonical one
+        url = crawler.canonicalize(response.url) or response.url
+        try:
+            with page_service.unit_of_work():
+                stored_page, unchanged = mark_if_unchanged(url, response)
+                if unchanged:
+                    mark_crawled(obj, url, stored_page.last_crawled)
+                    print(f"⏭️ - 🕷️ Page Crawl - {response.url} ({page_url}) - content unchanged, next crawl at {stored_page.next_crawl}.")
+                    continue
+
+                artifacts = host_artifacts.get(HostService.get_host_key(response.url))
+                if artifacts is not None and not host_service.get_host(response.url):
+                    host_service.upsert_host(response.url, **artifacts)
+                canonical_url = None
+                if parsed.simhash is not None:
+                    clusters = fingerprint_service.fingerprint(url, parsed.simhash)
+                    canonical_url = clusters.canonical_url
+                    page_service.update_clusters(recrawl_scheduler, clusters.demoted, clusters.released)
+                else:
+                    drop_fingerprint(url)
+                last_crawled = datetime.now()
+                store_page(page_url, url, response, parsed.meta_tags, parsed.links, stored_page, last_crawled, canonical_url)
+                mark_crawled(obj, url, last_crawled)
+        except Exception as e:
+            # a failing page rolls back its own changes and nobody else's
+            failed += 1
+            print(f"❌ - 🕷️ Page Crawl - {response.url} ({page_url}) - could not be stored:", e.__class__.__name__)
+    return failed
+
+
+async def parse_worker(parse_queue: asyncio.Queue, persist_queue: asyncio.Queue):
+    """Parse stage: hands fetched pages to the parse process pool until a None sentinel is read."""
+    loop = asyncio.get_running_loop()
+    while (item := await parse_queue.get()) is not None:
+        obj, page_url, response = item
+        started = time.monotonic()
+        pool = get_parse_pool()
+        try:
+            parsed = await loop.run_in_executor(pool, parse_page, response)
+        except BrokenProcessPool:
+            # a worker process died (e.g. lxml crashed), the pool is unusable from now on
+            print(f"❌ - 🕷️ Page Crawl - {response.url} ({page_url}) - parse process died, restarting the pool.")
+            reset_parse_pool(pool)
+            parse_stats.record(time.monotonic() - started, processed=0, failed=1)
+            continue
+        except Exception as e:
+            # one bad page must not stop the stage, the fetchers would block on the full queue
+            print(f"❌ - 🕷️ Page Crawl - {response.url} ({page_url}) - could not be parsed:", e.__class__.__name__, e)
+            parse_stats.record(time.monotonic() - started, processed=0, failed=1)
+            continue
+        parse_stats.record(time.monotonic() - started)
+        if parsed.fails:
+            print(f"❌ - 🕷️ Page Crawl - {response.url} ({page_url}) [{response.status_code}] - {[fail.name for fail in parsed.fails]}")
+            await forget_page(crawler.canonicalize(response.url) or response.url)
+            continue
+        await persist_queue.put((obj, page_url, response, parsed))
+
+
+async def forget_page(url: str):
+    """Drop the fingerprint of a page that is no longer valid, so it stops representing its near-duplicates."""
+    try:
+        await page_service.run(drop_fingerprint, url)
+    except Exception as e:
+        print(f"❌ - 🕷️ Page Crawl - ({url}) - could not drop its fingerprint:", e.__class__.__name__, e)
+
+
+async def persist_worker(persist_queue: asyncio.Queue):
+    """Persist stage: writes parsed pages in batches until a None sentinel is read."""
+    pipeline = config.crawler.pipeline
+    async for batch in iter_batches(persist_queue, pipeline.persist_batch_size, pipeline.persist_batch_seconds):
+        started = time.monotonic()
+        try:
+            # favicon, robots.txt and sitemap are per-host artifacts,
+            # only fetch them for the first page of a host.
+            new_hosts = await host_service.run(find_new_hosts, [(page_url, response) for _, page_url, response, _ in batch])
+            artifacts = await asyncio.gather(
+                *(asyncio.to_thread(fetch_host_artifacts, page_url, response) for page_url, response in new_hosts.values()),
+                return_exceptions=True,
+            )
+            # a host whose artifacts could not be fetched is retried with its next page
+            host_artifacts = {
+                host: host_artifact for host, host_artifact in zip(new_hosts, artifacts)
+                if not isinstance(host_artifact, BaseException)
+            }
+            failed = await db_adapter.executor.run(store_batch, batch, host_artifacts)
+        except Exception as e:
+            # one bad batch must not stop the stage, the parsers would block on the full queue
+            print(f"❌ - 🕷️ Page Crawl - batch of {len(batch)} pages could not be stored:", e.__class__.__name__, e)
+            failed = len(batch)
+        persist_stats.record(time.monotonic() - started, processed=len(batch) - failed, failed=failed)
+
+
+async def page_scan_task(obj: IPTableBase|PageTableBase, semaphore, parse_queue: asyncio.Queue):
+    """Fetch stage: downloads a page and queues it for parsing."""
     if obj.__class__.__name__.startswith(IPTableBase.__basename__):
         page_url = obj.domain or obj.ip
     elif obj.__class__.__name__.startswith(PageTableBase.__basename__):
@@ -32,89 +278,44 @@ async def page_scan_task(obj: IPTableBase|PageTableBase, semaphore):
         raise ValueError("Invalid object type")
 
     async with semaphore, aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=config.crawler.req_timeout)) as session:
+        started = time.monotonic()
         try:
+            # a cache miss downloads robots.txt, keep that off the event loop
+            robots = crawler.robots.get(page_url) or await asyncio.to_thread(crawler.robots.fetch, page_url)
+            if not robots.can_fetch(config.crawler.user_agent, page_url):
+                print(f"❌ - 🕷️ Page Crawl - ({page_url}) - disallowed by robots.txt")
+                # obj is a transient copy of the row, the mark has to be written explicitly
+                await page_service.run(mark_disallowed, obj)
+                return
+            await host_pacer.wait(page_url, robots.crawl_delay)
+
+            # database calls run on the DB thread, each in its own unit of work,
+            # so other fetches go on while they wait for the database
+            known_page = await page_service.run(
+                page_service.get_page, page_url, columns=("page_url", "etag", "last_modified", "last_crawled")
+            )
             headers = {
                 "User-Agent": config.crawler.user_agent,
+                **recrawl_scheduler.conditional_headers(known_page),
             }
             
             async with session.get(page_url, headers=headers) as response:
-                response = await ResponseConverter.from_aiohttp(response)
-                fails = validator.validate(response)
-                if fails:
-                    print(f"❌ - 🕷️ Page Crawl - {response.url} ({page_url}) [{response.status_code}] - {[fail.name for fail in fails]}")
-                    raise InvalidResponse("Response failed validation")
-
-                meta_tags = crawler.get_meta_tags(response)
-                favicon = crawler.get_favicon(response)
-                robots_txt = crawler.get_robots_txt(page_url)
-                sitemap = crawler.get_sitemap(response)
-                last_crawled = datetime.now()
+                if response.status == 304 and known_page:
+                    known_page = await page_service.run(mark_not_modified, obj, page_url, response.headers)
+                    fetch_stats.record(time.monotonic() - started)
+                    print(f"⏭️ - 🕷️ Page Crawl - ({page_url}) - not modified, next crawl at {known_page.next_crawl}.")
+                    return
 
-  
-                page_obj = page_service.generate_obj(
-                    "page_url",
-                    page_url=response.url,
-                    title=meta_tags.title,
-                    status_code=response.status_code,
-                    keywords=meta_tags.keywords,
-                    description=meta_tags.description,
-                    body=response.content_bytes,
-                    favicon=favicon,
-                    robotstxt=robots_txt,
-                    sitemap=sitemap,
-                    last_crawled=last_crawled,
-                )
-                
-                # Update the objects last_crawled
-                obj.last_crawled = last_crawled
-                page_service.upsert_page(page_obj)
-                print(f"✅ - 🕷️ Page Crawl - {response.url} ({page_url}) - added to the page session to be committed.")
-                
-                links = crawler.get_links(response)
-                if not links or not all([link.type == LinkType.INVALID for link in links]):
-                    print(f"Discovering {len(links)} links...")
-                    for link in links:
-                        # deleting backlinks from the source to the target to
-                        # prevent duplicates. It will be recreated later.
-                        backlink_service.delete_backlinks_by_source_to_target_url(page_url, link.full_url)
-                    for link in links:
-                        if not link.full_url:
-                            continue
-                        if link.type == LinkType.INTERNAL:
-                            if not page_service.get_page(link.full_url):
-                                page_service.add_page(
-                                    page_service.generate_obj(
-                                        "page_url",
-                                        page_url=link.full_url,
-                                        title=None,
-                                        status_code=None,
-                                        keywords=None,
-                                        description=None,
-                                        body=None,
-                                        favicon=None,
-                                        robotstxt=None,
-                                        sitemap=None,
-                                        last_crawled=None,
-                                    )
-                                )
-                                print(f"✅ - ↩️ Internal Page Discover - ({link.full_url}) - added to the page session to be committed.")
-                            else:
-                                print(f"⚠️ - ↩️ Internal Page Discover - ({link.full_url}) - already exists in the database.")
-                        elif link.type == LinkType.EXTERNAL:
-                            target_ip = ip_service.get_ip_by_domain(link.full_url)
-                            if not target_ip:
-                                # add new ip to URL frontier instead of directly adding to IP table
-                                # because we have not send a request to the IP to validate it yet.
-                                # we could, but it should not be the responsibility of the page scan task
-                                if not url_frontier_service.get_url(link.full_url):
-                                    url_frontier_service.add_url(link.full_url)
-                                    print(f"✅ - 🌐 External Page Discover - ({link.full_url}) - added to the URL frontier.")
-                                else :
-                                    print(f"⚠️ - 🌐 External Page Discover - ({link.full_url}) - already exists in the URL frontier.")
-                            backlink_service.add_backlink(BacklinkTable(source_url=page_url, target_url=link.full_url, anchor_text=link.anchor_text))
-                            print(f"✅ - 🔗 External Page Discover: Backlink - ({page_url}) -> ({link.full_url}) - added to the backlink session to be committed.")
-                else:
-                    print("No valid links found.")
+                try:
+                    # rejected by status or headers, the body is never downloaded
+                    response = await ResponseConverter.from_aiohttp(response, validator=header_validator)
+                except ResponseRejected as e:
+                    print(f"❌ - 🕷️ Page Crawl - {response.url} ({page_url}) [{response.status}] - {[fail.name for fail in e.fails]}")
+                    await forget_page(crawler.canonicalize(str(response.url)) or page_url)
+                    raise
+            fetch_stats.record(time.monotonic() - started)
+            # waits while the parsers are behind, holding the fetch slot
+            await parse_queue.put((obj, page_url, response))
         except (
             SQLAlchemyError,
             aiohttp.ClientConnectorError,
@@ -128,36 +329,51 @@ async def page_scan_task(obj: IPTableBase|PageTableBase, semaphore):
             # ValueError Unicode strings with encoding declaration are not supported. Please use bytes input or XML fragments without declaration.
             # Might need to handle this later
             # print(f"❌ - Page Crawl - ({page_url}) - ValueError", e.__class__.__name__, e)
-            pass
+            fetch_stats.record(time.monotonic() - started, processed=0, failed=1)
         except KeyboardInterrupt:
             raise KeyboardInterrupt
-        # except Exception as e:
-        #     print("❌ - 🕷️ CRITICAL ERROR:", e.__class__.__name__, e)
+        except Exception as e:
+            print(f"❌ - 🕷️ Page Crawl - ({page_url}) - CRITICAL ERROR:", e.__class__.__name__, e)
+            fetch_stats.record(time.monotonic() - started, processed=0, failed=1)
+
+
+async def watch_stages(work, stages: list[asyncio.Task]):
+    """Await work, cancelling it instead of waiting forever if a pipeline stage stops first.
+
+    Stages only return once they read their None sentinel, so a stage that
+    is done while work still runs has died and nobody drains its queue.
+    """
+    work = asyncio.ensure_future(work)
+    done, _ = await asyncio.wait({work, *stages}, return_when=asyncio.FIRST_COMPLETED)
+    if work in done:
+        return work.result()
+    work.cancel()
+    stage = done.pop()
+    error = None if stage.cancelled() else stage.exception()
+    raise RuntimeError(f"Pipeline stage {stage.get_name()} stopped early") from error
 
 
 async def generate_page_scan_tasks(semaphore, limit=10):
     calculate_ratio = lambda x, y: x / (x + y)
 
-    ips = ip_service.get_unscanned_ips()
-    pages = page_service.get_unscanned_pages()
-    
-    # randomize to prevent stale / unreachable IPs from being scanned over and over
-    driver = db_adapter.engine.url.get_dialect().driver
-    if driver == "pysqlite":
-        random.shuffle(ips)
-        random.shuffle(pages)
-    elif driver == "pymssql":
-        random.shuffle(ips)
-        random.shuffle(pages)
-    else:
-        raise NotImplementedError(f"Driver {driver} not supported")
+    # random samples, so stale / unreachable IPs are not scanned over and over.
+    # Twice the limit is read because other machines may hold leases on some.
+    ips = ip_service.sample_unscanned_ips(limit * 2)
+    # scan tasks only need the URL of a page, its body is never read here
+    pages = page_service.sample_unscanned_pages(limit * 2, columns=page_service.light_columns)
+    # pages whose adaptive revisit interval has passed compete with new pages
+    due_pages = page_service.get_due_pages(limit=limit, columns=page_service.light_columns)
+    pages += due_pages
+    random.shuffle(pages)
 
     if not len(ips) and not len(pages):
         print("No pages or IPs to scan.")
         return
 
-    # distribute limit proportionally
-    ip_limit = int(limit * calculate_ratio(len(ips), len(pages)))
+    # distribute limit proportionally to the backlogs
+    ip_backlog = max(ip_service.stats().unscanned_count, len(ips))
+    page_backlog = max(page_service.stats().unscanned_count, len(pages) - len(due_pages)) + len(due_pages)
+    ip_limit = int(limit * calculate_ratio(ip_backlog, page_backlog))
     page_limit = limit - ip_limit
     
     # prevent total dominance
@@ -168,40 +384,123 @@ async def generate_page_scan_tasks(semaphore, limit=10):
         page_limit = 1
         ip_limit -= 1
 
-    ips = ips[:ip_limit]
-    pages = pages[:page_limit]
+    # lease the work so other machines skip these IPs and pages
+    claimed_domains = set(lease_service.claim("ip", [ip_row.domain for ip_row in ips], limit=ip_limit))
+    claimed_urls = set(lease_service.claim("page", [page_row.page_url for page_row in pages], limit=page_limit))
+    # candidates are read as row tuples, only the claimed ones become ORM objects
+    ips = [ip_service.to_object(ip_row) for ip_row in ips if ip_row.domain in claimed_domains]
+    pages = [page_service.to_object(page_row) for page_row in pages if page_row.page_url in claimed_urls]
+    ip_limit = len(ips)
+    page_limit = len(pages)
 
     print(f"Generating task with {ip_limit} IPs and {page_limit} pages.")
+    # fetchers -> parse workers -> persister, the bounded queues hold back
+    # the earlier stages whenever a later one falls behind
+    pipeline = config.crawler.pipeline
+    parse_queue = asyncio.Queue(maxsize=pipeline.parse_queue_size)
+    persist_queue = asyncio.Queue(maxsize=pipeline.persist_queue_size)
+    parsers = [
+        asyncio.create_task(parse_worker(parse_queue, persist_queue), name=f"parse-{i}")
+        for i in range(pipeline.parse_processes)
+    ]
+    persister = asyncio.create_task(persist_worker(persist_queue), name="persist")
+
+    async def drain_parsers():
+        for _ in parsers:
+            await parse_queue.put(None)
+        await asyncio.gather(*parsers)
+
     tasks = []
     if ip_limit:
         for ip_obj in ips:
             task_name = f"IP-Task-{ip_obj.domain or ip_obj.ip}"
             print("Generating task:", task_name)
-            tasks.append(page_scan_task(ip_obj, semaphore))
+            tasks.append(page_scan_task(ip_obj, semaphore, parse_queue))
     if page_limit:
         for page_obj in pages:
             task_name = f"Page-Task-{page_obj.page_url}"
             print("Generating task:", task_name)
-            tasks.append(page_scan_task(page_obj, semaphore))
-    await asyncio.gather(*tasks)
+            tasks.append(page_scan_task(page_obj, semaphore, parse_queue))
+    try:
+        await watch_stages(asyncio.gather(*tasks), [*parsers, persister])
+        # drain the pipeline stage by stage
+        await watch_stages(drain_parsers(), [persister])
+        await watch_stages(persist_queue.put(None), [persister])
+        await persister
+    finally:
+        for stage in (*parsers, persister):
+            stage.cancel()
+        print(" | ".join(str(stats) for stats in (fetch_stats, parse_stats, persist_stats)))
+        # results are committed by main(), until then the leases keep other machines away
+        leased_work.append((claimed_domains, claimed_urls))
 
-validator = ResponseValidator()
-crawler = Crawler(config.crawler)
 
-db_adapter = load_db_adapter()
+def get_parse_pool():
+    global parse_pool
+    if parse_pool is None:
+        parse_pool = create_parse_pool(config.crawler.pipeline.parse_processes)
+    return parse_pool
 
-ip_service = IPService(db_adapter)
-page_service = PageService(db_adapter)
-url_frontier_service = URLFrontierService(db_adapter)
-backlink_service = BacklinkService(db_adapter)
 
+def reset_parse_pool(broken_pool):
+    """Drop a broken parse pool, the next get_parse_pool() starts a fresh one.
 
-print("Initial pages:", page_service.count())
+    Every parser awaiting the broken pool sees the error, only the first one
+    replaces it.
+    """
+    global parse_pool
+    if parse_pool is broken_pool:
+        parse_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
 
-print("Starting page scan...")
+parse_pool = None
+fetch_stats = StageStats("fetch")
+parse_stats = StageStats("parse")
+persist_stats = StageStats("persist")
+crawler = Crawler(config.crawler)
+recrawl_scheduler = RecrawlScheduler(config.crawler)
+host_pacer = HostPacer(config.crawler.max_crawl_delay_seconds)
+validator = ResponseValidator()
+# header checks run before the body is read, the parse stage skips them then
+header_validator = validator if config.crawler.header_prefilter else None
+
+# set by init_services, parse processes import this module again under
+# spawn (Windows, macOS) and must not open the database
+db_adapter = None
+ip_service = None
+page_service = None
+url_frontier_service = None
+backlink_service = None
+host_service = None
+fingerprint_service = None
+lease_service = None
+leased_work = []
 
 stop_event = threading.Event()
 
+
+def init_services():
+    """Create the database connection and services of the crawler process."""
+    global db_adapter, ip_service, page_service, url_frontier_service, backlink_service, host_service, \
+        fingerprint_service, lease_service
+    db_adapter = load_db_adapter()
+
+    ip_service = IPService(db_adapter)
+    page_service = PageService(db_adapter)
+    url_frontier_service = URLFrontierService(db_adapter)
+    backlink_service = BacklinkService(db_adapter)
+    host_service = HostService(db_adapter)
+    fingerprint_service = FingerprintService(db_adapter)
+    lease_service = LeaseService(db_adapter)
+    # page tables of older versions still hold the per-host artifacts
+    host_service.import_page_artifacts()
+
+    # crawl results are written in bulk instead of one row at a time
+    page_service.enable_write_behind()
+    url_frontier_service.enable_write_behind()
+    backlink_service.enable_write_behind()
+
+
 async def main():
     try:
         if stop_event.is_set():
@@ -220,14 +519,20 @@ async def main():
         page_service.commit(verbose=False)
         url_frontier_service.commit(verbose=False)
         backlink_service.commit(verbose=False)
-        print("Total pages:", len(page_service.get_pages()))
+        host_service.commit(verbose=False)
+        while leased_work:
+            claimed_domains, claimed_urls = leased_work.pop()
+            lease_service.release("ip", list(claimed_domains))
+            lease_service.release("page", list(claimed_urls))
+        page_stats = page_service.stats()
+        print(f"Total pages: {page_stats.row_count} ({page_stats.unscanned_count} unscanned, {page_stats.bytes / 2**20:.1f} MiB of bodies)")
 
 async def run():
     while True:
         try:
             await main()
             print("Finished scanning pages...")
-            if page_service.count_unscanned_pages() == 0:
+            if page_service.count_unscanned_pages() == 0 and not page_service.get_due_pages(limit=1, columns=("page_url",)):
                 await asyncio.sleep(30)
             else:
                 await asyncio.sleep(1)
@@ -237,4 +542,7 @@ async def run():
         except:
             pass
 if __name__ == "__main__":
+    init_services()
+    print("Initial pages:", page_service.count())
+    print("Starting page scan...")
     asyncio.run(run())
\ No newline at end of file
@@ -4,6 +4,10 @@ setlocal enabledelayedexpansion
 rem Activate the Python environment
 call .\.env\scripts\activate
 
+rem Only does something in SQLite single writer mode (buffered writes only), start it before the crawlers
+start cmd /c "title Storage - SQLite Writer & python sqlite_writer.py"
+timeout /t 2 /nobreak > nul
+
 start cmd /c "title Crawler - IP Search & python ip_search.py"
 start cmd /c "title Crawler - Page Search & python page_search.py" 
 start cmd /c "title Crawler - URL Frontier & python url_frontier_search.py"
@@ -0,0 +1,23 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database.adapter import DBAdapter
+from src.database.sqlite_writer import SQLiteWriter
+from src.utils import config
+
+
+if __name__ == "__main__":
+    if not config.storage.sqlite_single_writer:
+        print("Single writer mode is off (storage.sqlite_single_writer), nothing to do.")
+        sys.exit(0)
+
+    writer = SQLiteWriter(
+        DBAdapter(url=config.storage.sqlite_url),
+        ("localhost", config.storage.sqlite_writer_port),
+        authkey=config.storage.sqlite_writer_authkey.encode(),
+    )
+    try:
+        writer.serve_forever()
+    except KeyboardInterrupt:
+        print("Interrupted by user")
@@ -1,32 +1,149 @@
-from sqlalchemy import Index, create_engine, MetaData, union_all
-from sqlalchemy.orm import sessionmaker, Session
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from weakref import WeakSet
+
+from sqlalchemy import Index, create_engine, event, inspect, make_url, MetaData, union_all
+from sqlalchemy.orm import scoped_session, sessionmaker, Session
 from sqlalchemy.exc import OperationalError
+from src.database.db_executor import DBExecutor
+from src.database.partition_stats import install_partition_stats
+from src.database.schema_upgrade import upgrade_table
+from src.database.sqlite_writer import SQLiteWriterClient
 from src.models import Base
+from src.utils import config
 import pymssql
 
+def _set_sqlite_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    if config.storage.sqlite_wal or config.storage.sqlite_single_writer:
+        # WAL lets readers run next to the writer instead of behind it
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={config.storage.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={config.storage.sqlite_mmap_size}")
+        cursor.execute(f"PRAGMA cache_size={config.storage.sqlite_cache_size}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA busy_timeout={config.storage.sqlite_busy_timeout_ms}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
 class DBAdapter:
-    def __init__(self, **engine_kwargs,):
-        """Initialize the DBAdapter with a database URL."""
-        self.engine = create_engine(**engine_kwargs, pool_size=0, pool_pre_ping=True)
-        Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
-        self.persistent_session = None
+    def __init__(self, read_only=False, writer: SQLiteWriterClient = None, **engine_kwargs,):
+        """Initialize the DBAdapter with a database URL.
+
+        On SQLite every connection waits out locks for `sqlite_busy_timeout_ms`,
+        and with `storage.sqlite_wal` it is switched to WAL with the pragmas of
+        the storage config. Flushes of the write-behind buffers go to `writer`
+        if one is given, all other writes stay on this adapter's connections.
+        A `read_only` adapter refuses writes.
+        """
+        url = make_url(engine_kwargs.pop("url"))
+        if url.get_dialect().name == "sqlite" and url.database in (None, "", ":memory:"):
+            pool_kwargs = {}  # in memory databases live in a single connection
+        else:
+            pool_kwargs = dict(
+                pool_size=config.storage.db_pool_size,
+                max_overflow=config.storage.db_max_overflow,
+                pool_recycle=config.storage.db_pool_recycle_seconds,
+                pool_timeout=config.storage.db_pool_timeout_seconds,
+            )
+        self.engine = create_engine(url, **engine_kwargs, **pool_kwargs, pool_pre_ping=True)
+        self.read_only = read_only
+        self.writer = writer
+        if self.engine.url.get_dialect().name == "sqlite":
+            event.listen(self.engine, "connect", lambda dbapi_connection, _: _set_sqlite_pragmas(dbapi_connection, read_only))
+        if not self.read_only:
+            Base.metadata.create_all(self.engine)
+            with self.engine.begin() as connection:
+                for table in Base.metadata.sorted_tables:
+                    upgrade_table(connection, table)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        # one session per thread, and one per unit of work (see session_scope)
+        self.thread_sessions = scoped_session(self.Session, scopefunc=threading.get_ident)
+        # bumped by every commit of another session, see _refresh_stale
+        self._write_counter = itertools.count(1)
+        self.write_generation = 0
+        self._scoped_session: ContextVar[Optional[Session]] = ContextVar(f"scoped_session_{id(self)}", default=None)
+        self.write_buffers = WeakSet()
+        # blocking database work of coroutines, see BaseService.run
+        self.executor = DBExecutor(config.storage.db_executor_threads)
         self.class_registry = {}
+        self._model_lock = threading.Lock()
     
     def __enter__(self) -> 'DBAdapter':
         return self
     
     def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown()
         self.engine.dispose()
 
     def get_session(self, persistent=True) -> Session:
-        """Get a new Session."""
+        """Get the session of the current unit of work, or of the current thread outside of one.
+
+        With persistent=False a new session is returned that the caller has to close.
+        """
         if persistent:
-            if self.persistent_session is None:
-                self.persistent_session = self.Session(expire_on_commit=False)
-                self.persistent_session.begin()
-            return self.persistent_session
-        return self.Session(expire_on_commit=False)
+            session = self._scoped_session.get()
+            if session is None:
+                session = self.thread_sessions()
+                self._refresh_stale(session)
+            return session
+        return self.Session()
+
+    def mark_written(self, session: Optional[Session] = None):
+        """Record a commit, the other thread sessions refresh their objects before their next use.
+
+        `session` is the one that committed, it is up to date already.
+        """
+        self.write_generation = next(self._write_counter)
+        if session is not None:
+            session.info["write_generation"] = self.write_generation
+
+    def _refresh_stale(self, session: Session):
+        """Expire the unmodified objects of a thread session if other sessions committed since its last use.
+
+        Thread sessions live as long as their thread and do not expire on
+        commit, without this they keep returning the objects they loaded
+        first. Attributes with pending changes keep them.
+        """
+        generation = self.write_generation
+        if session.info.get("write_generation") == generation:
+            return
+        session.info["write_generation"] = generation
+        for obj in list(session.identity_map.values()):
+            state = inspect(obj)
+            if not state.committed_state:
+                session.expire(obj)
+                continue
+            unchanged = [attr.key for attr in state.attrs if attr.key not in state.committed_state]
+            if unchanged:
+                session.expire(obj, unchanged)
+
+    def in_session_scope(self) -> bool:
+        return self._scoped_session.get() is not None
+
+    @contextmanager
+    def session_scope(self):
+        """Bind a new session to the current task or thread until the block exits.
+
+        Context variables are copied into every asyncio task, so concurrent
+        tasks each get their own session. Nested scopes join the outer one.
+        """
+        session = self._scoped_session.get()
+        if session is not None:
+            yield session
+            return
+        session = self.Session()
+        token = self._scoped_session.set(session)
+        try:
+            yield session
+        finally:
+            self._scoped_session.reset(token)
+            session.close()
 
     def delete_db(self):
         """Delete the database."""
@@ -44,13 +161,20 @@ class DBAdapter:
         })
         
         # Add indexes to the new class
-        for index_prefix, column_name in base_type.index_prefixes:
+        for index_prefix, column_names in base_type.index_prefixes:
             index_name = f"{index_prefix}_{table_name}"
-            idx = Index(index_name, getattr(new_class, column_name))
+            if isinstance(column_names, str):
+                column_names = (column_names,)
+            idx = Index(index_name, *(getattr(new_class, column_name) for column_name in column_names))
             new_class.__table__.append_constraint(idx)
         
         # Create the table and add to registry
-        Base.metadata.create_all(self.engine)
+        if not self.read_only:
+            Base.metadata.create_all(self.engine)
+            with self.engine.begin() as connection:
+                # partitions created by an older version lack the newer columns
+                upgrade_table(connection, new_class.__table__)
+                install_partition_stats(connection, new_class.__table__)
         self.class_registry[table_name] = new_class
         
         return new_class
@@ -58,10 +182,28 @@ class DBAdapter:
     def get_model(self, table_name, base_type: type):
         if table_name in self.class_registry:
             return self.class_registry[table_name]
-        return self._create_model(table_name=table_name, base_type=base_type)
+        # the event loop and the DB threads may ask for a new partition at once
+        with self._model_lock:
+            if table_name in self.class_registry:
+                return self.class_registry[table_name]
+            return self._create_model(table_name=table_name, base_type=base_type)
     
 
-def load_db_adapter(echo=False):
+def load_sqlite_writer_client():
+    """Connect to the SQLite writer process, None if single writer mode is off or it is not running."""
+    if not config.storage.sqlite_single_writer:
+        return None
+    try:
+        return SQLiteWriterClient(
+            ("localhost", config.storage.sqlite_writer_port),
+            authkey=config.storage.sqlite_writer_authkey.encode(),
+        )
+    except (ConnectionError, OSError):
+        print("Warning: SQLite writer is not running, writing to the local database directly")
+        return None
+
+
+def load_db_adapter(echo=False, read_only=False):
     try:
         from data.credentials import (
             user, password, server, port, database
@@ -69,6 +211,7 @@ def load_db_adapter(echo=False):
         db_adapter = DBAdapter(
             url=f'mssql+pymssql://{user}:{password}@{server}:{port}/{database}?charset=utf8',
             echo=echo,
+            read_only=read_only,
         )
         # if not db_adapter.engine.connect():
         #     raise ConnectionError("Could not connect to the database")
@@ -80,4 +223,4 @@ def load_db_adapter(echo=False):
     except (ConnectionError, OperationalError, ModuleNotFoundError):
         # raise ConnectionError("Could not connect to the remote database")
         print("Warning: Could not connect to the database, falling back to local sqlite database")
-        return DBAdapter(url="sqlite:///data/search_engine.db", echo=echo)
+        return DBAdapter(url=config.storage.sqlite_url, echo=echo, read_only=read_only, writer=load_sqlite_writer_client())
@@ -0,0 +1,30 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DBExecutor:
+    """Runs blocking database calls on dedicated threads for coroutines to await.
+
+    A slow query or a commit waiting for a lock then only holds up the
+    coroutine that issued it, the event loop keeps serving the other fetches.
+    Sessions are per thread, so every DB thread keeps its own session and
+    connection; a single thread serializes all database work of a process.
+    """
+    def __init__(self, max_workers: int = 1, name: str = "db"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on a DB thread and return its result.
+
+        fn runs in a copy of the caller's context, sessions it binds with
+        session_scope do not leak into the coroutine or into other calls.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,117 @@
+from sqlalchemy import Table
+
+from src.models import PartitionStatsTable
+
+
+def _deltas(table: Table, dialect: str) -> dict[str, tuple[str, str]]:
+    """(added by a new row, removed by an old row) expressions per stats column.
+
+    SQLite triggers run per row and see NEW/OLD, MSSQL triggers run per
+    statement and see the inserted/deleted pseudo tables.
+    """
+    if dialect == "sqlite":
+        deltas = {"row_count": ("1", "1")}
+        if "last_crawled" in table.c:
+            deltas["unscanned_count"] = ("(NEW.last_crawled IS NULL)", "(OLD.last_crawled IS NULL)")
+        if "body" in table.c:
+            deltas["bytes"] = ("COALESCE(length(NEW.body), 0)", "COALESCE(length(OLD.body), 0)")
+        return deltas
+
+    deltas = {"row_count": ("(SELECT COUNT(*) FROM inserted)", "(SELECT COUNT(*) FROM deleted)")}
+    if "last_crawled" in table.c:
+        deltas["unscanned_count"] = (
+            "(SELECT COUNT(*) FROM inserted WHERE last_crawled IS NULL)",
+            "(SELECT COUNT(*) FROM deleted WHERE last_crawled IS NULL)",
+        )
+    if "body" in table.c:
+        deltas["bytes"] = (
+            "(SELECT COALESCE(SUM(CAST(DATALENGTH(body) AS BIGINT)), 0) FROM inserted)",
+            "(SELECT COALESCE(SUM(CAST(DATALENGTH(body) AS BIGINT)), 0) FROM deleted)",
+        )
+    return deltas
+
+
+def _insert_statement(table: Table, dialect: str) -> str:
+    """Create an empty stats row for the table unless it has one, keyed on the table_name primary key.
+
+    Several crawler processes may create the same partition at once, the
+    losers insert nothing instead of failing.
+    """
+    stats = PartitionStatsTable.__tablename__
+    columns = f"{stats} (table_name, row_count, unscanned_count, bytes)"
+    if dialect == "sqlite":
+        return f"INSERT OR IGNORE INTO {columns} VALUES ('{table.name}', 0, 0, 0)"
+    # the key-range lock keeps a concurrent insert out until this one commits
+    return (
+        f"INSERT INTO {columns} SELECT '{table.name}', 0, 0, 0 "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {stats} WITH (UPDLOCK, HOLDLOCK) WHERE table_name = '{table.name}')"
+    )
+
+
+def _count_statement(table: Table, dialect: str) -> str:
+    """Set the stats row of the table to the rows it already holds.
+
+    COALESCE goes around the subqueries, a constant selected from an empty
+    table is no row at all and the subquery NULL.
+    """
+    stats = PartitionStatsTable.__tablename__
+    unscanned = "SUM(CASE WHEN last_crawled IS NULL THEN 1 ELSE 0 END)" if "last_crawled" in table.c else "0"
+    length = "length(body)" if dialect == "sqlite" else "CAST(DATALENGTH(body) AS BIGINT)"
+    size = f"SUM({length})" if "body" in table.c else "0"
+    return (
+        f"UPDATE {stats} SET "
+        f"row_count = (SELECT COUNT(*) FROM {table.name}), "
+        f"unscanned_count = COALESCE((SELECT {unscanned} FROM {table.name}), 0), "
+        f"bytes = COALESCE((SELECT {size} FROM {table.name}), 0) "
+        f"WHERE table_name = '{table.name}'"
+    )
+
+
+def _sqlite_triggers(table: Table) -> list[str]:
+    stats = PartitionStatsTable.__tablename__
+    deltas = _deltas(table, "sqlite")
+    added = ", ".join(f"{column} = {column} + {new}" for column, (new, _) in deltas.items())
+    removed = ", ".join(f"{column} = {column} - {old}" for column, (_, old) in deltas.items())
+    changed = ", ".join(f"{column} = {column} + {new} - {old}" for column, (new, old) in deltas.items() if column != "row_count")
+    where = f"WHERE table_name = '{table.name}'"
+    triggers = [
+        f"CREATE TRIGGER IF NOT EXISTS trg_stats_insert_{table.name} AFTER INSERT ON {table.name} "
+        f"BEGIN UPDATE {stats} SET {added} {where}; END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_stats_delete_{table.name} AFTER DELETE ON {table.name} "
+        f"BEGIN UPDATE {stats} SET {removed} {where}; END",
+    ]
+    if changed:
+        triggers.append(
+            f"CREATE TRIGGER IF NOT EXISTS trg_stats_update_{table.name} AFTER UPDATE ON {table.name} "
+            f"BEGIN UPDATE {stats} SET {changed} {where}; END"
+        )
+    return triggers
+
+
+def _mssql_triggers(table: Table) -> list[str]:
+    stats = PartitionStatsTable.__tablename__
+    changes = ", ".join(f"{column} = {column} + {new} - {old}" for column, (new, old) in _deltas(table, "mssql").items())
+    trigger = (
+        f"CREATE TRIGGER trg_stats_{table.name} ON {table.name} AFTER INSERT, UPDATE, DELETE AS "
+        f"BEGIN SET NOCOUNT ON; UPDATE {stats} SET {changes} WHERE table_name = ''{table.name}''; END"
+    )
+    # CREATE TRIGGER has to be the only statement of its batch
+    return [f"IF OBJECT_ID('trg_stats_{table.name}', 'TR') IS NULL EXEC('{trigger}')"]
+
+
+def install_partition_stats(connection, table: Table):
+    """Seed the stats row of a partition table and install the triggers that maintain it."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        statements = _sqlite_triggers(table)
+    elif dialect == "mssql":
+        statements = _mssql_triggers(table)
+    else:
+        raise NotImplementedError(f"Partition stats are not supported on {dialect}")
+
+    created = connection.exec_driver_sql(_insert_statement(table, dialect)).rowcount == 1
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+    if created:
+        # counted after the triggers are in place, rows written meanwhile are included
+        connection.exec_driver_sql(_count_statement(table, dialect))
@@ -0,0 +1,76 @@
+from sqlalchemy import Table, inspect
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+
+def _add_column_statement(connection, table: Table, column) -> str:
+    preparer = connection.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=connection.dialect)
+    # MSSQL has no COLUMN keyword in ALTER TABLE ... ADD
+    add = "ADD COLUMN" if connection.dialect.name == "sqlite" else "ADD"
+    return f"ALTER TABLE {preparer.format_table(table)} {add} {preparer.format_column(column)} {column_type}"
+
+
+def _random_expression(connection) -> str:
+    """SQL for a random float in [0, 1), evaluated for every row."""
+    if connection.dialect.name == "mssql":
+        # RAND() without a seed is evaluated once per statement
+        return "RAND(CHECKSUM(NEWID()))"
+    return "(abs(random()) % 1000000000) / 1000000000.0"
+
+
+def _backfill_statement(connection, table: Table, column) -> str:
+    preparer = connection.dialect.identifier_preparer
+    name = preparer.format_column(column)
+    return (
+        f"UPDATE {preparer.format_table(table)} SET {name} = {_random_expression(connection)} WHERE {name} IS NULL"
+    )
+
+
+def drop_column(connection, table: Table, column_name: str):
+    """Drop a column an older version of a model had, the caller has moved its data elsewhere."""
+    preparer = connection.dialect.identifier_preparer
+    connection.exec_driver_sql(
+        f"ALTER TABLE {preparer.format_table(table)} DROP COLUMN {preparer.quote(column_name)}"
+    )
+
+
+def upgrade_table(connection, table: Table) -> list[str]:
+    """Add the nullable columns and the indexes a table created by an older version is missing.
+
+    create_all only creates tables that do not exist yet, so columns added to
+    the models later never reach existing databases. Safe to run on every
+    start and from several processes at once. Columns with
+    info={"backfill": "random"} get a random value in the existing rows.
+    Returns the added column names.
+    """
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        return []
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        if column.primary_key or not column.nullable:
+            raise RuntimeError(f"Can not add the required column {table.name}.{column.name}, migrate the table by hand.")
+        try:
+            with connection.begin_nested():
+                connection.exec_driver_sql(_add_column_statement(connection, table, column))
+                if column.info.get("backfill") == "random":
+                    connection.exec_driver_sql(_backfill_statement(connection, table, column))
+        except (OperationalError, ProgrammingError):
+            # another process added it first
+            if column.name not in {c["name"] for c in inspect(connection).get_columns(table.name)}:
+                raise
+            continue
+        added.append(column.name)
+        print(f"Added missing column {table.name}.{column.name}")
+
+    for index in table.indexes:
+        try:
+            with connection.begin_nested():
+                index.create(connection, checkfirst=True)
+        except (OperationalError, ProgrammingError):
+            if index.name not in {i["name"] for i in inspect(connection).get_indexes(table.name)}:
+                raise
+    return added
@@ -0,0 +1,151 @@
+import threading
+import time
+from multiprocessing.connection import Client, Listener, wait
+from typing import Optional
+
+from sqlalchemy import MetaData, Table, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError as saOperationalError
+from sqlite3 import OperationalError as slOperationalError
+
+from src.database.write_buffer import DELETE, INSERT, UPSERT
+from src.exceptions import WriteRejected
+
+
+
+class SQLiteWriter:
+    """The process that applies the write-behind flushes of every crawler to the local SQLite database.
+
+    Crawler processes send their buffered writes as (mode, table name, rows)
+    operations over a local connection. Everything that arrived since the
+    last round is applied in one transaction, so the bulk of the crawl volume
+    pays for one fsync per round instead of one per commit. Lease claims,
+    chunk progress and unit of work commits need their results right away
+    and are still written by the crawlers themselves, next to the writer.
+    """
+    def __init__(self, db_adapter, address: tuple[str, int], authkey: bytes):
+        self.db_adapter = db_adapter
+        self.address = address
+        self.authkey = authkey
+        self.metadata = MetaData()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _get_table(self, table_name: str) -> Table:
+        # partition tables are created by the crawlers, reflect them on first use
+        if table_name not in self.metadata.tables:
+            Table(table_name, self.metadata, autoload_with=self.db_adapter.engine)
+        return self.metadata.tables[table_name]
+
+    def _apply(self, connection, mode: str, table_name: str, rows: list[dict]) -> int:
+        table = self._get_table(table_name)
+        pk = [column.name for column in table.primary_key.columns]
+
+        if mode == DELETE:
+            count = 0
+            for row in rows:
+                count += connection.execute(delete(table).where(*(table.c[key] == value for key, value in row.items()))).rowcount
+            return count
+
+        # executemany needs every parameter set to have the same keys
+        by_keys = {}
+        for row in rows:
+            by_keys.setdefault(tuple(row), []).append(row)
+        for keys, parameter_sets in by_keys.items():
+            statement = sqlite_insert(table)
+            if not all(key in keys for key in pk):
+                pass  # autoincrement rows never conflict
+            elif mode == INSERT or all(key in pk for key in keys):
+                statement = statement.on_conflict_do_nothing(index_elements=pk)
+            elif mode == UPSERT:
+                statement = statement.on_conflict_do_update(
+                    index_elements=pk,
+                    set_={key: statement.excluded[key] for key in keys if key not in pk},
+                )
+            else:
+                raise ValueError(f"Unknown write mode: {mode}")
+            connection.execute(statement, parameter_sets)
+        return len(rows)
+
+    def _handle(self, requests: list[tuple]) -> list[tuple]:
+        """Apply the operations of all requests in one transaction, returns a reply per request."""
+        try:
+            with self.db_adapter.engine.begin() as connection:
+                counts = [sum(self._apply(connection, *op) for op in ops) for _, ops in requests]
+            return [(client, ("ok", count)) for (client, _), count in zip(requests, counts)]
+        except (saOperationalError, slOperationalError) as e:
+            return [(client, ("locked", str(e))) for client, _ in requests]
+        except Exception as e:
+            if len(requests) == 1:
+                return [(requests[0][0], ("error", f"{e.__class__.__name__}: {e}"))]
+            # one bad request must not fail the others, retry them one by one
+            return [reply for request in requests for reply in self._handle([request])]
+
+    def _accept(self, listener: Listener):
+        while True:
+            connection = listener.accept()
+            with self._lock:
+                self._connections.append(connection)
+
+    def serve_forever(self, stop_event: Optional[threading.Event] = None):
+        listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+        print(f"📝 SQLite writer listening on {self.address[0]}:{self.address[1]}")
+
+        while not (stop_event and stop_event.is_set()):
+            with self._lock:
+                connections = list(self._connections)
+            if not connections:
+                time.sleep(0.1)
+                continue
+
+            requests = []
+            for connection in wait(connections, timeout=0.5):
+                try:
+                    requests.append((connection, connection.recv()))
+                except (EOFError, OSError):
+                    with self._lock:
+                        self._connections.remove(connection)
+            if not requests:
+                continue
+
+            for connection, reply in self._handle(requests):
+                try:
+                    connection.send(reply)
+                except OSError:
+                    pass
+        listener.close()
+
+
+class SQLiteWriterClient:
+    """Sends writes to the SQLiteWriter process and waits until they are committed."""
+    def __init__(self, address: tuple[str, int], authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._connection = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+
+    def write(self, ops: list[tuple[str, str, list[dict]]]) -> int:
+        """Apply (mode, table name, rows) operations atomically, returns the number of rows written."""
+        with self._lock:
+            try:
+                if self._connection is None:
+                    self._connection = Client(self.address, authkey=self.authkey)
+                self._connection.send(ops)
+                status, result = self._connection.recv()
+            except (EOFError, OSError) as e:
+                # reconnect on the next write, the writer may have been restarted
+                self._connection = None
+                raise ConnectionError(f"SQLite writer unreachable: {e}") from e
+
+        if status == "locked":
+            raise slOperationalError(result)
+        if status == "error":
+            raise WriteRejected(result)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,289 @@
+import random
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import delete, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError as saOperationalError
+from sqlite3 import OperationalError as slOperationalError
+
+
+UPSERT = "upsert"
+INSERT = "insert"  # insert if absent, never overwrites an existing row
+DELETE = "delete"  # rows are the column values of the rows to delete
+
+
+def jittered_backoff(attempt: int, base_delay: float = 0.5, max_delay: float = 30.0) -> float:
+    """Exponential backoff with full jitter, in seconds."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class WriteBehindBuffer:
+    """Collects ORM objects of one entity type and writes them in bulk.
+
+    Objects with the same primary key are coalesced, the last upsert wins and
+    inserts never replace a buffered or stored row. The buffer is flushed once
+    `max_rows` objects are buffered or the oldest one is `max_age_seconds`
+    old. If flushing fails the objects stay buffered; once `max_pending`
+    objects pile up, producers are blocked in `add` until the database
+    accepts them again. Deletes are buffered too, they run before the
+    inserts of their flush.
+    """
+    def __init__(self, db_adapter, name: str, max_rows: int = 500, max_age_seconds: float = 5.0,
+                 max_pending: int = 5000, max_retries: int = 5, chunk_size: int = 500):
+        self.db_adapter = db_adapter
+        self.name = name
+        self.max_rows = max_rows
+        self.max_age_seconds = max_age_seconds
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size  # keeps IN (...) lists below MSSQL's parameter limit
+        self._rows: dict = {}
+        self._oldest: Optional[float] = None
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @staticmethod
+    def _identity(obj) -> tuple:
+        mapper = inspect(type(obj))
+        pk = tuple(getattr(obj, column.key) for column in mapper.primary_key)
+        if any(value is None for value in pk):
+            # autoincrement rows can not be coalesced
+            return (type(obj), id(obj))
+        return (type(obj), pk)
+
+    def add(self, obj, mode: str = UPSERT) -> bool:
+        """Buffer an object, returns False if an insert was dropped because the row is already buffered."""
+        with self._lock:
+            key = self._identity(obj)
+            if mode == INSERT and key in self._rows:
+                return False
+            self._rows[key] = (mode, obj)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = self._is_due()
+
+        if self.db_adapter.in_session_scope():
+            # flushed, and the producer held back if the buffer is full, once
+            # the unit of work is committed; the database may be locked by it until then
+            return True
+        if due:
+            self.flush()
+        self._wait_for_room()
+        return True
+
+    def delete(self, model, **values):
+        """Delete the rows of model with the given column values when the buffer is flushed.
+
+        Buffered rows it matches are dropped right away. Flushes run one at a
+        time and deletes go first, so rows written by earlier flushes are
+        deleted and rows buffered after the delete are kept.
+        """
+        with self._lock:
+            for key, (mode, obj) in list(self._rows.items()):
+                if mode != DELETE and type(obj) is model and all(getattr(obj, column) == value for column, value in values.items()):
+                    del self._rows[key]
+            self._rows[(model, (DELETE, tuple(sorted(values.items()))))] = (DELETE, values)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = self._is_due()
+
+        if self.db_adapter.in_session_scope():
+            return
+        if due:
+            self.flush()
+        self._wait_for_room()
+
+    def _wait_for_room(self):
+        while len(self._rows) >= self.max_pending:
+            # backpressure: the database is not keeping up, block the producer
+            print(f"Write buffer {self.name} is full ({len(self._rows)} rows), waiting for the database...")
+            self.flush()
+
+    def get(self, model, *pk):
+        """The buffered object of a primary key, None if it is not buffered."""
+        with self._lock:
+            row = self._rows.get((model, pk))
+        return row[1] if row else None
+
+    def upsert(self, obj) -> bool:
+        return self.add(obj, UPSERT)
+
+    def insert(self, obj) -> bool:
+        return self.add(obj, INSERT)
+
+    def _is_due(self) -> bool:
+        if not self._rows:
+            return False
+        if len(self._rows) >= self.max_rows:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.max_age_seconds
+
+    def flush_if_due(self) -> bool:
+        """Flush if the buffer is due, and block until it is below `max_pending` again."""
+        with self._lock:
+            due = self._is_due()
+        flushed = self.flush() if due else True
+        self._wait_for_room()
+        return flushed
+
+    @staticmethod
+    def _to_values(obj, columns) -> dict:
+        values = {}
+        for column in columns:
+            value = getattr(obj, column.key)
+            if value is None and column.columns[0].default is not None and column.columns[0].default.is_scalar:
+                value = column.columns[0].default.arg
+            values[column.key] = value
+        return values
+
+    def _write(self, session, model, rows: list[tuple[str, object]]):
+        for mode, values in rows:
+            if mode == DELETE:
+                session.execute(delete(model).where(*(getattr(model, column) == value for column, value in values.items())))
+        rows = [row for row in rows if row[0] != DELETE]
+        if not rows:
+            return
+
+        mapper = inspect(model)
+        columns = mapper.column_attrs
+        pk_columns = mapper.primary_key
+
+        if len(pk_columns) != 1:
+            for mode, obj in rows:
+                if mode == INSERT and session.get(model, self._identity(obj)[1]):
+                    continue
+                session.merge(obj)
+            return
+
+        pk = pk_columns[0].key
+        keyed = [(mode, self._to_values(obj, columns)) for mode, obj in rows]
+        inserts, updates = [], []
+        for start in range(0, len(keyed), self.chunk_size):
+            chunk = keyed[start:start + self.chunk_size]
+            keys = [values[pk] for _, values in chunk if values[pk] is not None]
+            existing = set(session.scalars(select(getattr(model, pk)).where(getattr(model, pk).in_(keys)))) if keys else set()
+            for mode, values in chunk:
+                if values[pk] is None:
+                    values.pop(pk)
+                    inserts.append(values)
+                elif values[pk] not in existing:
+                    inserts.append(values)
+                elif mode == UPSERT:
+                    updates.append(values)
+
+        # executemany needs every parameter set to have the same keys
+        by_keys = {}
+        for values in inserts:
+            by_keys.setdefault(tuple(values), []).append(values)
+        for parameter_sets in by_keys.values():
+            session.execute(insert(model), parameter_sets)
+        if updates:
+            session.execute(update(model), updates)
+
+    def _to_ops(self, by_model: dict) -> list[tuple[str, str, list[dict]]]:
+        ops = []
+        for model, rows in by_model.items():
+            mapper = inspect(model)
+            pk = [column.key for column in mapper.primary_key]
+            deletes = [dict(obj) for row_mode, obj in rows if row_mode == DELETE]
+            if deletes:
+                ops.append((DELETE, model.__tablename__, deletes))
+            for mode in (UPSERT, INSERT):
+                values = []
+                for row_mode, obj in rows:
+                    if row_mode != mode:
+                        continue
+                    row = self._to_values(obj, mapper.column_attrs)
+                    for key in pk:
+                        if row[key] is None:
+                            row.pop(key)  # autoincrement
+                    values.append(row)
+                if values:
+                    ops.append((mode, model.__tablename__, values))
+        return ops
+
+    def _write_each(self, session, rows: dict) -> int:
+        """Write and commit rows one at a time, dropping only the ones that conflict.
+
+        Written rows are removed from `rows`, so a retry after a lock error
+        does not write them twice. Returns the number of dropped rows.
+        """
+        dropped = 0
+        # deletes first, as in a bulk write
+        for key, row in sorted(rows.items(), key=lambda item: item[1][0] != DELETE):
+            try:
+                self._write(session, key[0], [row])
+                session.commit()
+            except IntegrityError as e:
+                session.rollback()
+                dropped += 1
+                print(f"Dropping a conflicting row of {self.name}:", e.__class__.__name__, e.orig)
+            del rows[key]
+        return dropped
+
+    def _send(self, by_model: dict):
+        """Hand the rows to the single writer process, returns once they are committed."""
+        self.db_adapter.writer.write(self._to_ops(by_model))
+
+    def flush(self) -> bool:
+        """Write all buffered objects, retrying lock errors with jittered backoff."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._rows:
+                    return True
+                rows = self._rows
+                self._rows = {}
+                self._oldest = None
+
+            writer = self.db_adapter.writer
+            session = self.db_adapter.get_session(persistent=False) if writer is None else None
+            row_by_row = False
+            try:
+                for attempt in range(self.max_retries):
+                    by_model = {}
+                    for (model, _), row in rows.items():
+                        by_model.setdefault(model, []).append(row)
+                    try:
+                        if writer is not None:
+                            # the writer upserts with ON CONFLICT, rows never conflict there
+                            self._send(by_model)
+                            return True
+                        if row_by_row:
+                            return self._write_each(session, rows) == 0
+                        for model, model_rows in by_model.items():
+                            self._write(session, model, model_rows)
+                        session.commit()
+                        return True
+                    except IntegrityError:
+                        # another process inserted some of the rows between the existence
+                        # check and the insert; write them one by one and lose only those
+                        session.rollback()
+                        row_by_row = True
+                    except (saOperationalError, slOperationalError, ConnectionError) as e:
+                        if session is not None:
+                            session.rollback()
+                        delay = jittered_backoff(attempt)
+                        print(f"Database locked while flushing {self.name}, retrying in {delay:.2f}s:", e.__class__.__name__)
+                        time.sleep(delay)
+                    except Exception as e:
+                        # not transient, retrying or keeping the rows would block the buffer forever
+                        if session is not None:
+                            session.rollback()
+                        print(f"Error flushing {self.name}, dropping {len(rows)} rows:", e.__class__.__name__, e)
+                        return False
+            finally:
+                if session is not None:
+                    session.close()
+                self.db_adapter.mark_written()
+
+            # keep the rows, newer objects buffered in the meantime win
+            with self._lock:
+                for key, row in rows.items():
+                    self._rows.setdefault(key, row)
+                self._oldest = self._oldest or time.monotonic()
+            print(f"Failed to flush {len(rows)} rows of {self.name}, they stay buffered.")
+            return False
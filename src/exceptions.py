@@ -3,3 +3,12 @@ class InvalidResponse(Exception):
 
 class ContentLanguageNotAllowed(InvalidResponse):
     pass
+
+class ResponseRejected(InvalidResponse):
+    """A response that failed validation, `fails` holds the FailEnum reasons."""
+    def __init__(self, fails: list):
+        self.fails = fails
+        super().__init__(str([fail.name for fail in fails]))
+
+class WriteRejected(Exception):
+    pass
@@ -1,5 +1,5 @@
 import string
-from sqlalchemy import Column, DateTime, Float, Index, Integer, LargeBinary, String
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, Integer, LargeBinary, String
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -20,10 +20,12 @@ class URLFrontierTable(Base, RepresentableTable):
 
 class IPTableBase(object):
     __basename__ = "ip_table"
+    partition_column = "domain"  # the value get_partition_tablename is called with
     partition_keys = list(string.ascii_lowercase)
     index_prefixes = [
         ("idx_ip", "ip"),
-        ("idx_ip_last_crawled", "last_crawled")
+        ("idx_ip_last_crawled", "last_crawled"),
+        ("idx_ip_crawl_queue", ("last_crawled", "crawl_key")),
     ]
 
     domain = Column(String(255), primary_key=True)
@@ -32,6 +34,8 @@ class IPTableBase(object):
     status = Column(Integer)
     score = Column(Float, default=0.0, nullable=False)
     last_crawled = Column(DateTime, nullable=True, default=None)
+    # random in [0, 1), see PartitionedService.sample; rows older than the column get one on upgrade
+    crawl_key = Column(Float, nullable=True, default=None, info={"backfill": "random"})
     
     @staticmethod
     def _get_partition_key(url: str):
@@ -52,10 +56,13 @@ class IPTableBase(object):
 
 class PageTableBase(object):
     __basename__ = "page_table"
+    partition_column = "page_url"  # the value get_partition_tablename is called with
     partition_keys = list(string.ascii_lowercase)
     index_prefixes = [
         ("idx_page_url", "page_url"),
-        ("idx_page_table_last_crawled", "last_crawled")
+        ("idx_page_table_last_crawled", "last_crawled"),
+        ("idx_page_table_next_crawl", "next_crawl"),
+        ("idx_page_table_crawl_queue", ("last_crawled", "crawl_key")),
     ]
     
     page_url = Column(String(255), primary_key=True)
@@ -64,10 +71,17 @@ class PageTableBase(object):
     keywords = Column(String, nullable=True)
     description = Column(String, nullable=True)
     body = Column(LargeBinary, nullable=True)
-    favicon = Column(LargeBinary, nullable=True)
-    robotstxt = Column(LargeBinary, nullable=True)
-    sitemap = Column(LargeBinary, nullable=True)
     last_crawled = Column(DateTime, nullable=True, default=None)
+    # re-crawl bookkeeping, see src.modules.recrawl_scheduler
+    etag = Column(String(255), nullable=True)
+    last_modified = Column(String(64), nullable=True)
+    content_hash = Column(String(64), nullable=True)  # sha256 of the raw body
+    indexed_hash = Column(String(64), nullable=True)  # content_hash the document index was built from
+    last_changed = Column(DateTime, nullable=True, default=None)
+    recrawl_interval = Column(Integer, nullable=True)  # minutes
+    next_crawl = Column(DateTime, nullable=True, default=None)
+    # random in [0, 1), see PartitionedService.sample; rows older than the column get one on upgrade
+    crawl_key = Column(Float, nullable=True, default=None, info={"backfill": "random"})
 
     @staticmethod
     def _get_partition_key(url: str):
@@ -89,6 +103,7 @@ class PageTableBase(object):
 
 class DocumentIndexTableBase(object):
     __basename__ = "document_index"
+    partition_column = "word"  # the value get_partition_tablename is called with
     partition_keys = list(string.ascii_lowercase)
     index_prefixes = [
         ("idx_document_url", "document_url"),
@@ -127,6 +142,68 @@ class BacklinkTable(Base, RepresentableTable):
     )
 
 
+class BlobTable(Base, RepresentableTable):
+    """Deduplicated binary content addressed by its sha256 hash."""
+    __tablename__ = "blobs"
+
+    hash = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class HostTable(Base, RepresentableTable):
+    """Per-host artifacts (favicon, robots.txt, sitemap) referenced by blob hash."""
+    __tablename__ = "hosts"
+
+    host = Column(String(255), primary_key=True)  # scheme://netloc
+    favicon_hash = Column(String(64), nullable=True)
+    robotstxt_hash = Column(String(64), nullable=True)
+    sitemap_hash = Column(String(64), nullable=True)
+    last_updated = Column(DateTime, nullable=True, default=None)
+
+
+class ChunkProgressTable(Base, RepresentableTable):
+    """Ledger of IP scan chunks, used to resume ip_search after a restart."""
+    __tablename__ = "ip_chunk_progress"
+
+    chunk = Column(String(64), primary_key=True)  # e.g. 0-8.0-8.0-8.0-8
+    status = Column(String(16), nullable=False)  # ChunkStatus
+    checkpoint = Column(Integer, nullable=False, default=0)  # addresses fully scanned, in chunk order
+    hit_count = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, nullable=True, default=None)
+    checkpointed_at = Column(DateTime, nullable=True, default=None)
+    finished_at = Column(DateTime, nullable=True, default=None)
+
+    __table_args__ = (
+        Index('idx_chunk_status', 'status'),
+    )
+
+
+class WorkLeaseTable(Base, RepresentableTable):
+    """Time limited claims on units of crawl work, shared by all crawler machines."""
+    __tablename__ = "work_leases"
+
+    kind = Column(String(32), primary_key=True)  # e.g. ip_chunk, ip, page
+    item = Column(String(255), primary_key=True)
+    owner = Column(String(255), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('idx_work_leases_owner', 'owner'),
+        Index('idx_work_leases_expires_at', 'expires_at'),
+    )
+
+
+class PartitionStatsTable(Base, RepresentableTable):
+    """Row counts of the partition tables, kept up to date by triggers on every write."""
+    __tablename__ = "partition_stats"
+
+    table_name = Column(String(255), primary_key=True)  # e.g. page_table_a
+    row_count = Column(BigInteger, nullable=False, default=0)
+    unscanned_count = Column(BigInteger, nullable=False, default=0)  # rows with last_crawled IS NULL
+    bytes = Column(BigInteger, nullable=False, default=0)  # stored size of the body column
+
+
 class SearchResultTable(Base, RepresentableTable):
     __tablename__ = "search_results"
 
@@ -136,4 +213,25 @@ class SearchResultTable(Base, RepresentableTable):
     
     __table_args__ = (
         Index('idx_query', 'query'),
-    )
\ No newline at end of file
+    )
+
+class PageFingerprintTable(Base, RepresentableTable):
+    """SimHash of every crawled page, banded for the near-duplicate lookup (see src.modules.simhash)."""
+    __tablename__ = "page_fingerprints"
+
+    page_url = Column(String(255), primary_key=True)
+    simhash = Column(BigInteger, nullable=False)  # signed, see simhash.to_signed
+    band_0 = Column(Integer, nullable=False)
+    band_1 = Column(Integer, nullable=False)
+    band_2 = Column(Integer, nullable=False)
+    band_3 = Column(Integer, nullable=False)
+    canonical_url = Column(String(255), nullable=True)  # representative of the cluster, None for the representative itself
+    updated_at = Column(DateTime, nullable=True, default=None)
+
+    __table_args__ = (
+        Index('idx_page_fingerprints_band_0', 'band_0'),
+        Index('idx_page_fingerprints_band_1', 'band_1'),
+        Index('idx_page_fingerprints_band_2', 'band_2'),
+        Index('idx_page_fingerprints_band_3', 'band_3'),
+        Index('idx_page_fingerprints_canonical_url', 'canonical_url'),
+    )
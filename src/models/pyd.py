@@ -1,7 +1,8 @@
 from enum import Enum
 from typing import List, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+from requests.structures import CaseInsensitiveDict
 
 class WordFrequency(BaseModel):
     word: str
@@ -27,33 +28,96 @@ class FailEnum(Enum):
     NOT_TURKISH = 2  # Content-Language, meta tags, etc.
     NO_CONTENT = 3  # empty response body
     INVALID_CONTENT_TYPE = 4  # not text/html
+    TOO_LARGE = 5  # Content-Length above max_body_bytes
+
+class ChunkStatus(Enum):
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    DONE = "done"
+
+class TableStats(BaseModel):
+    row_count: int = 0
+    unscanned_count: int = 0
+    bytes: int = 0
 
 class MaxWorkerConfig(BaseModel):
     ip_search: int
     url_frontier: int
     page_search: int
 
+class PipelineConfig(BaseModel):
+    parse_processes: int = 2  # worker processes parsing fetched pages
+    parse_queue_size: int = 256  # fetched pages waiting to be parsed, fetchers block beyond this
+    persist_queue_size: int = 256  # parsed pages waiting to be written, parsers block beyond this
+    persist_batch_size: int = 32  # parsed pages written per database call
+    persist_batch_seconds: float = 1.0  # longest wait for a batch to fill up
+
+class URLCanonicalizationConfig(BaseModel):
+    # query parameters dropped from every url, a trailing * matches a prefix
+    strip_query_params: list[str] = ["utm_*", "gclid", "fbclid", "yclid", "msclkid", "mc_cid", "mc_eid", "_ga", "sessionid", "phpsessid", "jsessionid", "sid"]
+    strip_trailing_slash: bool = True  # /a/ and /a are stored as the same page
+    cache_size: int = 65536  # memoized urls per process
+
 class CrawlerConfig(BaseModel):
     parallelism: int  # number of programs running at the same time
     max_workers: MaxWorkerConfig  # number of threads in the pool
     chunk_size: int
     req_timeout: int
+    probe_timeout: float = 1.5  # TCP connect timeout of the ip_search pre-probe
+    checkpoint_interval: int = 1024  # addresses per ip_search sub-chunk checkpoint
     user_agent: str
     allowed_protocols: list[str]
     retry_after_minutes: int
     max_document_length: int
+    max_body_bytes: int = 2097152  # responses larger than this are aborted while streaming
+    header_prefilter: bool = True  # validate status and headers before downloading the body
+    ip_blocklist: list[str] = []  # CIDR networks that are never scanned, on top of the reserved ones
     ports: List[int]
     shuffle_chunks: bool
     invalid_file_extensions: list[str]
     accepted_status_codes: list[int]
+    robots_cache_ttl_minutes: int = 60
+    robots_cache_negative_ttl_minutes: int = 10
+    max_crawl_delay_seconds: float = 10.0  # robots.txt Crawl-delay is honored up to this
+    recrawl_max_interval_minutes: int = 10080
+    recrawl_backoff_factor: float = 2.0
+    near_duplicate_distance: int = 6  # SimHash bits two near-duplicate pages may differ in, lookups cost more above 7
+    pipeline: PipelineConfig = PipelineConfig()  # fetch -> parse -> persist stages of page_search
+    url_canonicalization: URLCanonicalizationConfig = URLCanonicalizationConfig()
 
 class SystemConfig(BaseModel):
     machine_id: int
     total_machines: int
+    lease_ttl_seconds: int = 300  # work leases of dead machines are reclaimed after this
+
+class StorageConfig(BaseModel):
+    body_codec: str = "zlib"  # raw, zlib, lzma or zstd (requires zstandard)
+    body_compression_level: Optional[int] = None
+    commit_max_retries: int = 5
+    write_buffer_max_rows: int = 500  # flush a write-behind buffer once it holds this many rows
+    write_buffer_max_age_seconds: float = 5.0  # or once its oldest row is this old
+    write_buffer_max_pending: int = 5000  # producers block while a buffer holds this many rows
+    db_pool_size: int = 10  # connections kept open per process
+    db_max_overflow: int = 20  # extra connections opened under load
+    db_pool_recycle_seconds: int = 1800  # reconnect before the server drops idle connections
+    db_pool_timeout_seconds: int = 30
+    db_executor_threads: int = 1  # threads running the database calls of the async crawlers
+    sqlite_url: str = "sqlite:///data/search_engine.db"  # fallback when the remote database is unreachable
+    sqlite_wal: bool = False  # WAL journal with the sync, mmap and cache pragmas below, for many processes on one file
+    sqlite_synchronous: str = "NORMAL"  # NORMAL is durable enough in WAL mode and skips most fsyncs
+    sqlite_mmap_size: int = 268435456  # bytes of the database file read through mmap
+    sqlite_cache_size: int = -65536  # page cache, negative values are KiB
+    sqlite_busy_timeout_ms: int = 30000
+    # send write-behind buffer flushes to sqlite_writer.py, implies sqlite_wal. Leases, chunk
+    # progress and unit of work commits still write directly, waiting out the lock with busy_timeout
+    sqlite_single_writer: bool = False
+    sqlite_writer_port: int = 6010
+    sqlite_writer_authkey: str = "search-engine"
 
 class Config(BaseModel):
     crawler: CrawlerConfig
     system: SystemConfig
+    storage: StorageConfig = StorageConfig()
 
 
 class LinkType(Enum):
@@ -68,9 +132,12 @@ class Link(BaseModel):
     base_url: str
     href: str
     anchor_text: Union[str, None]
+    url: Optional[str] = None  # href resolved against the page and canonicalized
 
     @property
     def full_url(self):
+        if self.url is not None:
+            return self.url
         if self.type == LinkType.INTERNAL and self.href.startswith("/"):
             return f"{self.base_url}{self.href}"
         return self.href
@@ -81,6 +148,13 @@ class MetaTags(BaseModel):
     description: Union[str, None]
     keywords: Union[str, None]
 
+class ParsedPage(BaseModel):
+    """What the parse stage of page_search extracts from a fetched page."""
+    fails: Optional[list[FailEnum]] = None  # validation failures, nothing else is extracted then
+    meta_tags: Optional[MetaTags] = None
+    links: list = []  # (type, url, anchor_text) tuples, see src.modules.link_extractor
+    simhash: Optional[int] = None  # fingerprint of the visible text, see src.modules.simhash
+
 class UniformResponse(BaseModel):
     """
     A single source of truth for all kinds of responses from different libraries
@@ -90,3 +164,9 @@ class UniformResponse(BaseModel):
     headers: dict
     body: Optional[str]
     content_bytes: Optional[bytes]
+
+    @field_validator("headers", mode="after")
+    @classmethod
+    def _case_insensitive_headers(cls, headers: dict) -> CaseInsensitiveDict:
+        # header names are case-insensitive, servers send "content-type" as often as "Content-Type"
+        return CaseInsensitiveDict(headers)
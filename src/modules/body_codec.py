@@ -0,0 +1,77 @@
+import lzma
+import zlib
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class BodyCodec:
+    """Compresses stored page bodies and tags them with a small header.
+
+    Encoded bodies start with `MAGIC` followed by a single codec id byte.
+    Bodies without the header are treated as legacy uncompressed rows, so
+    existing databases keep working and can be migrated lazily.
+    """
+    MAGIC = b"\x00SEB"
+    RAW = 0
+    ZLIB = 1
+    LZMA = 2
+    ZSTD = 3
+
+    codec_ids = {
+        "raw": RAW,
+        "zlib": ZLIB,
+        "lzma": LZMA,
+        "zstd": ZSTD,
+    }
+
+    def __init__(self, codec: str = "zlib", level: Optional[int] = None):
+        if codec not in self.codec_ids:
+            raise ValueError(f"Unknown body codec: {codec}")
+        if codec == "zstd" and zstandard is None:
+            print("Warning: zstandard is not installed, falling back to zlib body compression")
+            codec = "zlib"
+        self.codec = codec
+        self.codec_id = self.codec_ids[codec]
+        self.level = level
+
+    @classmethod
+    def is_encoded(cls, data: Optional[bytes]) -> bool:
+        return bool(data) and data[:len(cls.MAGIC)] == cls.MAGIC
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec_id == self.ZLIB:
+            return zlib.compress(data, self.level if self.level is not None else 6)
+        if self.codec_id == self.LZMA:
+            return lzma.compress(data, preset=self.level if self.level is not None else 6)
+        if self.codec_id == self.ZSTD:
+            return zstandard.ZstdCompressor(level=self.level if self.level is not None else 3).compress(data)
+        return data
+
+    def encode(self, data: Optional[bytes]) -> Optional[bytes]:
+        """Compress the body with the configured codec. Already encoded bodies are returned as is."""
+        if not data or self.is_encoded(data):
+            return data
+        return self.MAGIC + bytes((self.codec_id,)) + self._compress(data)
+
+    @classmethod
+    def decode(cls, data: Optional[bytes]) -> Optional[bytes]:
+        """Return the raw body, whichever codec it was encoded with."""
+        if not cls.is_encoded(data):
+            return data
+        codec_id = data[len(cls.MAGIC)]
+        payload = data[len(cls.MAGIC) + 1:]
+        if codec_id == cls.RAW:
+            return payload
+        if codec_id == cls.ZLIB:
+            return zlib.decompress(payload)
+        if codec_id == cls.LZMA:
+            return lzma.decompress(payload)
+        if codec_id == cls.ZSTD:
+            if zstandard is None:
+                raise ValueError("Body is zstd compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        raise ValueError(f"Unknown body codec id: {codec_id}")
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional
+from urllib.parse import urlsplit
+
+from src.models import ParsedPage, UniformResponse
+from src.modules.crawler import Crawler
+from src.modules.response_validator import ResponseValidator
+from src.modules.simhash import simhash, visible_text
+from src.utils import config
+
+
+# Stage building blocks of the page_search pipeline:
+# async fetchers -> process pool parsers -> batched persister, connected by
+# bounded asyncio queues so a slow stage holds back the ones before it.
+
+_crawler: Optional[Crawler] = None
+_validator: Optional[ResponseValidator] = None
+
+
+def init_parser():
+    """Process pool initializer, builds the parser of the worker process once."""
+    global _crawler, _validator
+    _crawler = Crawler(config.crawler)
+    _validator = ResponseValidator()
+
+
+def parse_page(response: UniformResponse) -> ParsedPage:
+    """Validate a fetched page, extract its meta tags and links and fingerprint it. Runs in a parse worker process."""
+    if _crawler is None:
+        init_parser()
+    # the fetch stage already ran the header checks when header_prefilter is on
+    fails = _validator.validate(response, headers_checked=config.crawler.header_prefilter)
+    if fails:
+        return ParsedPage(fails=fails)
+    return ParsedPage(
+        meta_tags=_crawler.get_meta_tags(response),
+        links=_crawler.extract_links(response),
+        simhash=simhash(visible_text(response.content_bytes or response.body)),
+    )
+
+
+def create_parse_pool(processes: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=processes, initializer=init_parser)
+
+
+class StageStats:
+    """Throughput counters of one pipeline stage."""
+    def __init__(self, name: str):
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._started = time.monotonic()
+
+    def record(self, seconds: float, processed: int = 1, failed: int = 0):
+        self.processed += processed
+        self.failed += failed
+        self.busy_seconds += seconds
+
+    @property
+    def throughput(self) -> float:
+        """Items per second of wall time since the stage was created."""
+        return self.processed / max(time.monotonic() - self._started, 1e-9)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.processed} done, {self.failed} failed, "
+            f"{self.throughput:.2f}/s, {self.busy_seconds:.1f}s busy"
+        )
+
+
+class HostPacer:
+    """Spaces out the requests of the fetchers to each host by its robots.txt Crawl-delay.
+
+    Every request reserves the next free slot of its host, so concurrent
+    fetchers of one host queue up behind each other. Delays are capped at
+    `max_delay` seconds.
+    """
+    def __init__(self, max_delay: float):
+        self.max_delay = max_delay
+        self._next_slot: dict[str, float] = {}
+
+    async def wait(self, url: str, delay: Optional[float]):
+        if not delay:
+            return
+        host = urlsplit(url).netloc.lower()
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + min(delay, self.max_delay)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def iter_batches(queue: asyncio.Queue, size: int, max_wait: float) -> AsyncIterator[list]:
+    """Yield lists of up to `size` queued items until a None sentinel is read.
+
+    A batch is cut short once its first item waited `max_wait` seconds.
+    """
+    done = False
+    while not done:
+        item = await queue.get()
+        if item is None:
+            return
+        batch = [item]
+        deadline = time.monotonic() + max_wait
+        while len(batch) < size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        yield batch
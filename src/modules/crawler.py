@@ -9,14 +9,15 @@ from typing import List, Optional
 from lxml import html
 # import tldextract
 from urllib.parse import urlparse
-from urllib import robotparser
 import requests
 
 
+from src.modules.link_extractor import LinkExtractor, LinkRow
+from src.modules.robots_cache import RobotsCache
+from src.modules.url_canonicalizer import URLCanonicalizer
 from src.utils import tag_weights
 from src.models import (
     CrawlerConfig,
-    LinkType,
     Link,
     MetaTags,
 )
@@ -24,7 +25,9 @@ from src.models import (
 class Crawler:
     def __init__(self, config: CrawlerConfig):
         self.config = config
-        self.parser = robotparser.RobotFileParser()
+        self.robots = RobotsCache(config)
+        self.urls = URLCanonicalizer(config)
+        self.link_extractor = LinkExtractor(config, self.urls)
     
     def _get_base_url(self, url: str, lib:str='urllib') -> str:
         if lib == 'urllib':
@@ -36,55 +39,29 @@ class Crawler:
         else:
             raise ValueError("lib not supported")
 
-    def can_fetch(self, robotstxt:bytes, url:str) -> bool:
-        self.parser.parse(robotstxt.decode("utf-8").splitlines())
-        return self.parser.can_fetch(self.config.user_agent, url)
+    def can_fetch(self, url:str) -> bool:
+        """Check the url against the cached robots.txt rules of its host."""
+        return self.robots.can_fetch(url)
 
-    def _get_link_type(self, page_url: str, link: str) -> LinkType:
-        base_url = self._get_base_url(page_url)
-        
-        # Check invalid file extensions
-        if any([link.endswith(ext) for ext in self.config.invalid_file_extensions]):
-            return LinkType.INVALID
-
-        # Check if the link is in the same domain
-        if base_url in link:
-            return LinkType.INTERNAL
+    def canonicalize(self, url: str, base: Optional[str] = None) -> Optional[str]:
+        """The canonical form of a url, resolved against base. None for urls that can not be crawled."""
+        return self.urls.canonicalize(url, base)
 
-        # Check if the link is in the same subdomain
-        if self._get_base_url(link) == base_url:
-            return LinkType.INTERNAL
+    def origin(self, url: str) -> Optional[str]:
+        """The canonical scheme://host[:port] of a url, the key of its host in the IP table."""
+        return self.urls.origin(url)
 
-        # Check if the link starts with /
-        if link.startswith("/"):
-            return LinkType.INTERNAL
-
-        if link.startswith("http"):
-            return LinkType.EXTERNAL
-
-        # TODO check other cases like mailto, tel, #
-        return LinkType.INVALID
+    def extract_links(self, response: UniformResponse) -> List[LinkRow]:
+        """The classified links of a page as (type, url, anchor_text) tuples."""
+        return self.link_extractor.extract(response)
 
     def get_links(self, response: UniformResponse) -> List[Link]:
-        result = []
-        try:
-            content = response.body
-            tree = html.fromstring(content)
-            tags = tree.xpath("//a")
-            links_and_anchor_texts = [(tag.get("href"), tag.text) for tag in tags]
-        except Exception as e:
-            print("There was an error parsing the html:", e)
-            return result
-        
-        # check if link is external or internal
-        for link, anchor in links_and_anchor_texts:
-            link = str(link)
-            # TODO sanitize more here
-            link_type = self._get_link_type(response.url, link)
-            base_url = self._get_base_url(response.url)
-            result.append(Link(type=link_type, base_url=base_url, href=link, anchor_text=anchor))
-
-        return result
+        page_url = self.canonicalize(response.url) or response.url
+        base_url = self._get_base_url(page_url)
+        return [
+            Link(type=link.type, base_url=base_url, href=link.url, anchor_text=link.anchor_text, url=link.url)
+            for link in self.extract_links(response)
+        ]
 
     def get_meta_tags(self, response: UniformResponse) -> MetaTags:
         try:
@@ -192,17 +169,8 @@ class Crawler:
         return None
         
     def get_robots_txt(self, response: UniformResponse|str) -> Optional[bytes]:
-        if isinstance(response, str):
-            base_url = self._get_base_url(response)
-        else:
-            base_url = self._get_base_url(response.url)
-        try:
-            with requests.get(base_url + "/robots.txt") as r:
-                if r.status_code == 200 and r.headers.get("Content-Type") == "text/plain":
-                    return r.content
-        except Exception as e:
-            print("Could not get robots.txt with the following url:", base_url)
-        return None
+        url = response if isinstance(response, str) else response.url
+        return self.robots.fetch(url).raw
 
     def get_sitemap(self, response: UniformResponse) -> Optional[bytes]:
         base_url = self._get_base_url(response.url)
@@ -0,0 +1,74 @@
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from urllib.parse import urljoin, urlsplit
+
+from lxml import html
+
+from src.models import CrawlerConfig, LinkType, UniformResponse
+from src.modules.url_canonicalizer import URLCanonicalizer
+
+
+class LinkRow(NamedTuple):
+    """A link found on a page: its type, canonical url and anchor text."""
+    type: LinkType
+    url: str
+    anchor_text: Optional[str]
+
+
+class LinkExtractor:
+    """Extracts and classifies the links of a page in a single pass over its anchors.
+
+    The page url and host are worked out once per page. Per link there is a
+    memoized canonicalization, a memoized host and file suffix lookup, and a
+    few comparisons.
+    """
+    def __init__(self, config: CrawlerConfig, canonicalizer: URLCanonicalizer):
+        self.canonicalizer = canonicalizer
+        self.invalid_suffixes = tuple(extension.lower() for extension in config.invalid_file_extensions)
+        self._split = lru_cache(maxsize=config.url_canonicalization.cache_size)(self._split_url)
+
+    def _split_url(self, url: str) -> tuple[str, bool]:
+        """Host of a canonical url, and whether it points to a file type we do not crawl."""
+        parts = urlsplit(url)
+        return parts.netloc, parts.path.lower().endswith(self.invalid_suffixes)
+
+    def extract(self, response: UniformResponse) -> list[LinkRow]:
+        """The links of a page, each canonical url once with the anchor text of its first occurrence.
+
+        Links without a crawlable url (mailto:, tel:, javascript:, ...) are left out.
+        """
+        try:
+            tree = html.fromstring(response.body)
+        except Exception as e:
+            print("There was an error parsing the html:", e)
+            return []
+
+        canonicalize = self.canonicalizer.canonicalize
+        page_url = canonicalize(response.url) or response.url
+        page_host = self._split(page_url)[0]
+        # relative links resolve against <base href> or the url the page was served from,
+        # neither is canonicalized, dropping a trailing slash would change what "guide.html" means
+        base_url = response.url
+        base = tree.find(".//base[@href]")
+        if base is not None and base.get("href").strip():
+            try:
+                base_url = urljoin(response.url, base.get("href").strip())
+            except ValueError:
+                pass
+
+        links = {}
+        for anchor in tree.iter("a"):
+            href = anchor.get("href")
+            url = canonicalize(href, base=base_url) if href is not None else None
+            if url is None or url in links:
+                continue
+            host, invalid_suffix = self._split(url)
+            if invalid_suffix or url == page_url:
+                # files, and #fragments and other links back to the page itself
+                link_type = LinkType.INVALID
+            elif host == page_host:
+                link_type = LinkType.INTERNAL
+            else:
+                link_type = LinkType.EXTERNAL
+            links[url] = LinkRow(link_type, url, anchor.text)
+        return list(links.values())
@@ -17,7 +17,7 @@ def _get_base_url(url: str) -> str:
     return result
 
 crawler = Crawler(config.crawler)
-adapter = load_db_adapter()
+adapter = load_db_adapter(read_only=True)
 document_index_service = DocumentIndexService(adapter)
 ip_service = IPService(adapter)
 page_service = PageService(adapter)
@@ -60,7 +60,7 @@ class PageRank:
         domain_scores = []
         for page_score in page_scores:
             document = page_score.document
-            ip_obj = ip_service.get_ip_by_domain(_get_base_url(document.url))
+            ip_obj = ip_service.get_ip_by_domain(crawler.origin(document.url) or _get_base_url(document.url))
             domain_score = ip_obj.score if ip_obj else 0
             domain_scores.append(domain_score)
         domain_scores = self.normalize(domain_scores)
@@ -118,7 +118,7 @@ class PageRank:
     
     def _attach_document_metadata(self, page_scores: list[PageScore]):
         for page_score in page_scores:
-            document = page_service.get_page(page_score.document.url)
+            document = page_service.get_page(page_score.document.url, columns=("title", "description"))
             if not document:
                 continue
             page_score.document.title = document.title
@@ -0,0 +1,96 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from src.models import CrawlerConfig, PageTableBase
+
+
+class RecrawlScheduler:
+    """Decides when a crawled page is due again.
+
+    Every page starts with `retry_after_minutes` as its revisit interval. The
+    interval is multiplied by `recrawl_backoff_factor` each time a page is found
+    unchanged (304 or identical content hash) and divided by it when the page
+    changed, bounded by `retry_after_minutes` and `recrawl_max_interval_minutes`.
+    """
+    def __init__(self, config: CrawlerConfig):
+        self.min_interval = config.retry_after_minutes
+        self.max_interval = config.recrawl_max_interval_minutes
+        self.backoff_factor = config.recrawl_backoff_factor
+
+    @staticmethod
+    def hash_content(body: Optional[bytes]) -> Optional[str]:
+        if body is None:
+            return None
+        return hashlib.sha256(body).hexdigest()
+
+    def conditional_headers(self, page: Optional[PageTableBase]) -> dict:
+        """Return the If-None-Match / If-Modified-Since headers for a stored page."""
+        headers = {}
+        if page is None or page.last_crawled is None:
+            return headers
+        if page.etag:
+            headers["If-None-Match"] = page.etag
+        if page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    def has_changed(self, page: Optional[PageTableBase], body: Optional[bytes]) -> bool:
+        if page is None or page.content_hash is None:
+            return True
+        return page.content_hash != self.hash_content(body)
+
+    def _schedule(self, page: PageTableBase, changed: bool, now: datetime):
+        interval = page.recrawl_interval or self.min_interval
+        if changed:
+            interval = interval / self.backoff_factor
+        else:
+            interval = interval * self.backoff_factor
+        interval = int(min(max(interval, self.min_interval), self.max_interval))
+
+        page.recrawl_interval = interval
+        page.last_crawled = now
+        page.next_crawl = now + timedelta(minutes=interval)
+
+    def _store_validators(self, page: PageTableBase, headers: dict):
+        page.etag = headers.get("ETag") or page.etag
+        page.last_modified = headers.get("Last-Modified") or page.last_modified
+
+    def mark_not_modified(self, page: PageTableBase, headers: dict = None, now: datetime = None) -> PageTableBase:
+        """Reschedule a page that answered 304 or returned identical content."""
+        now = now or datetime.now()
+        self._store_validators(page, headers or {})
+        self._schedule(page, changed=False, now=now)
+        return page
+
+    def mark_duplicate(self, page: PageTableBase, now: datetime = None) -> PageTableBase:
+        """Revisit a near-duplicate page only every `recrawl_max_interval_minutes`, it may diverge from its canonical page."""
+        now = now or datetime.now()
+        page.recrawl_interval = self.max_interval
+        page.next_crawl = now + timedelta(minutes=self.max_interval)
+        return page
+
+    def mark_disallowed(self, page: PageTableBase, now: datetime = None) -> PageTableBase:
+        """Check a page robots.txt disallows again only every `recrawl_max_interval_minutes`, the rules may change."""
+        now = now or datetime.now()
+        page.recrawl_interval = self.max_interval
+        page.last_crawled = now
+        page.next_crawl = now + timedelta(minutes=self.max_interval)
+        return page
+
+    def mark_changed(self, page: PageTableBase, headers: dict, previous: Optional[PageTableBase] = None,
+                     body: Optional[bytes] = None, now: datetime = None) -> PageTableBase:
+        """Record the validators and content hash of a freshly fetched page and reschedule it.
+
+        `body` must be the raw (uncompressed) body the hash is calculated from.
+        """
+        now = now or datetime.now()
+        if previous is not None:
+            page.recrawl_interval = previous.recrawl_interval
+        page.etag = None
+        page.last_modified = None
+        self._store_validators(page, headers)
+        page.content_hash = self.hash_content(body)
+        page.last_changed = now
+        self._schedule(page, changed=True, now=now)
+        return page
@@ -1,21 +1,58 @@
-
-from src.models import UniformResponse
+from typing import Optional
+from src.exceptions import ResponseRejected
+from src.models import FailEnum, UniformResponse
+from src.modules.response_validator import ResponseValidator
+from src.utils import config
 import requests
 import aiohttp
 
 class ResponseConverter:
     @staticmethod
-    async def from_aiohttp(response: aiohttp.ClientResponse) -> UniformResponse:
+    async def _read_capped(response: aiohttp.ClientResponse, max_bytes: Optional[int], chunk_size: int) -> bytes:
+        """Read the body in chunks, aborting as soon as it grows past max_bytes."""
+        if max_bytes is None:
+            return await response.read()
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(chunk_size):
+            size += len(chunk)
+            if size > max_bytes:
+                # no or a wrong Content-Length, the header check could not catch it
+                raise ResponseRejected([FailEnum.TOO_LARGE])
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    def _decode(body_bytes: bytes, charset: Optional[str]) -> str:
+        try:
+            return body_bytes.decode(charset or 'utf-8')
+        except (UnicodeDecodeError, LookupError):
+            return body_bytes.decode('iso-8859-9')  # Turkish encoding
+
+    @staticmethod
+    async def from_aiohttp(
+        response: aiohttp.ClientResponse,
+        validator: Optional[ResponseValidator] = None,
+        max_bytes: Optional[int] = config.crawler.max_body_bytes,
+        chunk_size: int = 64 * 1024,
+    ) -> UniformResponse:
+        """Convert an aiohttp response, streaming at most `max_bytes` of its body.
+
+        With a validator its header checks run first, a response they reject
+        raises ResponseRejected (an InvalidResponse) without any of its body
+        being read. So does a body that grows past `max_bytes`.
+        """
         if isinstance(response, aiohttp.client._RequestContextManager):
             raise ValueError("""
             aiohttp.ClientSession.get() is an async context manager and not a response object.
             Please use `async with session.get(url) as response:` and pass the response object to this method.
             """)
-        try:
-            body_bytes = await response.read()
-            body = body_bytes.decode('utf-8')
-        except UnicodeDecodeError:
-            body = body_bytes.decode('iso-8859-9')  # Turkish encoding
+        if validator is not None:
+            fails = validator.validate_headers(ResponseConverter.head_from_aiohttp(response))
+            if fails:
+                raise ResponseRejected(fails)
+        body_bytes = await ResponseConverter._read_capped(response, max_bytes, chunk_size)
+        body = ResponseConverter._decode(body_bytes, response.charset)
 
         return UniformResponse(
             url=str(response.url),
@@ -25,6 +62,17 @@ class ResponseConverter:
             content_bytes=body_bytes
         )
 
+    @staticmethod
+    def head_from_aiohttp(response: aiohttp.ClientResponse) -> UniformResponse:
+        """The status line and headers of an aiohttp response, without reading its body."""
+        return UniformResponse(
+            url=str(response.url),
+            body=None,
+            headers=response.headers,
+            status_code=response.status,
+            content_bytes=None
+        )
+
     @staticmethod
     def from_requests(response: requests.Response) -> UniformResponse:
         return UniformResponse(
@@ -33,4 +81,4 @@ class ResponseConverter:
             headers=response.headers,
             status_code=response.status_code,
             body_bytes=response.content
-        )
\ No newline at end of file
+        )
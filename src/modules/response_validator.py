@@ -1,20 +1,38 @@
-from typing import Union
+from typing import Callable, NamedTuple, Union
 from lxml import html
 
 from src.models import FailEnum
 from src.models import UniformResponse
 from src.utils import config
 
+
+class Check(NamedTuple):
+    name: str
+    func: Callable[[UniformResponse], Union[None, FailEnum]]
+    headers_only: bool  # needs nothing but the status line and headers
+
+
 class ResponseValidator:
+    """Runs the registered checks in order, cheapest first, and stops at the first failure.
+
+    Header-only checks can run on their own through `validate_headers`
+    before the body is downloaded; `validate` then skips them when told
+    they already passed.
+    """
     def __init__(self, exclude: tuple[callable] = None):
         self.exclude = exclude or tuple()
-    
-    def _check_content_exists(
-        self, response: UniformResponse
-    ) -> Union[None, FailEnum]:
-        if response.body:
-            return None
-        return FailEnum.NO_CONTENT
+        self.checks: list[Check] = []
+        self.register("status_code", self._check_status_code, headers_only=True)
+        self.register("content_type", self._check_content_type, headers_only=True)
+        self.register("content_length", self._check_content_length, headers_only=True)
+        self.register("content_exists", self._check_content_exists)
+        self.register("content_language", self._check_content_language)
+
+    def register(self, name: str, func: Callable[[UniformResponse], Union[None, FailEnum]], headers_only: bool = False):
+        """Append a check to the pipeline, after the ones already registered."""
+        if name in self.exclude or getattr(func, "__func__", func) in self.exclude:
+            return
+        self.checks.append(Check(name, func, headers_only))
 
     def _check_status_code(
         self, response: UniformResponse
@@ -23,6 +41,34 @@ class ResponseValidator:
             return FailEnum.INVALID_STATUS_CODE
         return None
 
+    def _check_content_type(
+        self, response: UniformResponse
+    ) -> Union[None, FailEnum]:
+        if 'text/html' in response.headers.get("Content-Type", ''):
+            return None
+        return FailEnum.INVALID_CONTENT_TYPE
+
+    def _check_content_length(
+        self, response: UniformResponse
+    ) -> Union[None, FailEnum]:
+        # servers may leave the header out or send garbage, the body checks cover those
+        try:
+            length = int(response.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            return None
+        if length == 0:
+            return FailEnum.NO_CONTENT
+        if length > config.crawler.max_body_bytes:
+            return FailEnum.TOO_LARGE
+        return None
+
+    def _check_content_exists(
+        self, response: UniformResponse
+    ) -> Union[None, FailEnum]:
+        if response.body:
+            return None
+        return FailEnum.NO_CONTENT
+
     def _check_content_language(
         self, response: UniformResponse
     ) -> Union[None, FailEnum]:
@@ -46,25 +92,23 @@ class ResponseValidator:
 
         return FailEnum.NOT_TURKISH
 
-    def _check_content_type(
+    def _run(self, response: UniformResponse, checks: list[Check]) -> Union[None, list[FailEnum]]:
+        for check in checks:
+            fail = check.func(response)
+            if fail is not None:
+                return [fail]
+        return None
+
+    def validate_headers(
         self, response: UniformResponse
-    ) -> Union[None, FailEnum]:
-        if 'text/html' in response.headers.get("Content-Type", ''):
-            return None
-        return FailEnum.INVALID_CONTENT_TYPE
+    ) -> Union[None, list[FailEnum]]:
+        """Run only the header checks, `response` needs no body."""
+        return self._run(response, [check for check in self.checks if check.headers_only])
 
     def validate(
-        self, response: UniformResponse
+        self, response: UniformResponse, headers_checked: bool = False
     ) -> Union[None, list[FailEnum]]:
-        fails = []
-        for func in dir(self):
-            if func.startswith("__") or func == "validate":
-                continue
-
-            check_func = getattr(self, func)
-            if callable(check_func):
-                fail = check_func(response)
-                if fail is not None:
-                    fails.append(fail)
-
-        return fails or None
+        """The first failing check as a one element list, None if the response is valid."""
+        if headers_checked:
+            return self._run(response, [check for check in self.checks if not check.headers_only])
+        return self._run(response, self.checks)
@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import Optional
+from urllib import robotparser
+from urllib.parse import urlparse
+
+import requests
+
+from src.models import CrawlerConfig
+
+
+class RobotsEntry:
+    """Parsed robots.txt rules of a single host."""
+    __slots__ = ("raw", "parser", "crawl_delay", "allow_all", "expires_at")
+
+    def __init__(self, raw: Optional[bytes], parser: Optional[robotparser.RobotFileParser],
+                 crawl_delay: Optional[float], allow_all: bool, expires_at: float):
+        self.raw = raw
+        self.parser = parser
+        self.crawl_delay = crawl_delay
+        self.allow_all = allow_all
+        self.expires_at = expires_at
+
+    def is_expired(self, now: float = None) -> bool:
+        return (now if now is not None else time.monotonic()) >= self.expires_at
+
+    def can_fetch(self, user_agent: str, url: str) -> bool:
+        if self.allow_all or self.parser is None:
+            return True
+        return self.parser.can_fetch(user_agent, url)
+
+
+class RobotsCache:
+    """Host keyed cache of parsed robots.txt rules.
+
+    Every host is downloaded and parsed once per TTL, afterwards `can_fetch`
+    is a dictionary lookup plus a rule match. Missing robots.txt files (4xx)
+    and unreachable hosts are cached as "allow all" with a shorter TTL so they
+    are not requested again for every page.
+    """
+    def __init__(self, config: CrawlerConfig):
+        self.config = config
+        self.ttl = config.robots_cache_ttl_minutes * 60
+        self.negative_ttl = config.robots_cache_negative_ttl_minutes * 60
+        self._entries: dict[str, RobotsEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_host_key(url: str) -> str:
+        parsed_uri = urlparse(url)
+        return f"{parsed_uri.scheme}://{parsed_uri.netloc}".lower()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str) -> Optional[RobotsEntry]:
+        """Return the cached entry of the url's host without touching the network."""
+        entry = self._entries.get(self._get_host_key(url))
+        if entry is None or entry.is_expired():
+            return None
+        return entry
+
+    def store(self, url: str, robotstxt: Optional[bytes]) -> RobotsEntry:
+        """Parse and cache the robots.txt of the url's host. `None` caches a negative entry."""
+        now = time.monotonic()
+        if robotstxt is None:
+            entry = RobotsEntry(None, None, None, allow_all=True, expires_at=now + self.negative_ttl)
+        else:
+            parser = robotparser.RobotFileParser()
+            parser.parse(robotstxt.decode("utf-8", errors="ignore").splitlines())
+            crawl_delay = parser.crawl_delay(self.config.user_agent)
+            entry = RobotsEntry(
+                robotstxt,
+                parser,
+                float(crawl_delay) if crawl_delay is not None else None,
+                allow_all=False,
+                expires_at=now + self.ttl,
+            )
+        with self._lock:
+            self._entries[self._get_host_key(url)] = entry
+        return entry
+
+    def _download(self, host: str) -> Optional[bytes]:
+        try:
+            with requests.get(
+                host + "/robots.txt",
+                headers={"User-Agent": self.config.user_agent},
+                timeout=self.config.req_timeout,
+            ) as r:
+                if r.status_code == 200 and "text/plain" in r.headers.get("Content-Type", ""):
+                    return r.content
+        except Exception:
+            print("Could not get robots.txt with the following url:", host)
+        return None
+
+    def fetch(self, url: str) -> RobotsEntry:
+        """Return the entry of the url's host, downloading robots.txt only on a cache miss."""
+        entry = self.get(url)
+        if entry is not None:
+            return entry
+        host = self._get_host_key(url)
+        return self.store(host, self._download(host))
+
+    def can_fetch(self, url: str) -> bool:
+        return self.fetch(url).can_fetch(self.config.user_agent, url)
+
+    def crawl_delay(self, url: str) -> Optional[float]:
+        """Return the Crawl-delay (in seconds) the url's host requests for our user agent."""
+        return self.fetch(url).crawl_delay
+
+    def evict_expired(self) -> int:
+        """Drop expired entries, returns the number of removed hosts."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [host for host, entry in self._entries.items() if entry.is_expired(now)]
+            for host in expired:
+                del self._entries[host]
+        return len(expired)
@@ -0,0 +1,127 @@
+import re
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import quote, unquote_plus, urljoin, urlsplit, urlunsplit
+
+from src.models import CrawlerConfig
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+_UNRESERVED = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+# characters a path may contain unescaped, "%" keeps existing escapes intact
+_SAFE_PATH = "/:@!$&'()*+,;=-._~%"
+_SAFE_QUERY = _SAFE_PATH + "?"
+_ESCAPE = re.compile(r"%([0-9A-Fa-f]{2})")
+
+
+def _normalize_escape(match: re.Match) -> str:
+    char = chr(int(match.group(1), 16))
+    return char if char in _UNRESERVED else f"%{match.group(1).upper()}"
+
+
+def _remove_dot_segments(path: str) -> str:
+    """RFC 3986 section 5.2.4, for absolute paths."""
+    segments = path.split("/")
+    resolved = []
+    for segment in segments:
+        if segment == "..":
+            if len(resolved) > 1:
+                resolved.pop()
+        elif segment != ".":
+            resolved.append(segment)
+    if segments[-1] in (".", ".."):
+        resolved.append("")
+    return "/".join(resolved)
+
+
+class URLCanonicalizer:
+    """Turns the urls of links, responses and frontier entries into the single form they are stored under.
+
+    Relative references are resolved against the page they appear on (RFC
+    3986), scheme and host are lowercased, default ports, fragments, user
+    info and the configured tracking parameters are dropped, the remaining
+    query parameters are sorted and the path is normalized. Results are
+    memoized by absolute url, the same links show up on every page of a site.
+    """
+    def __init__(self, config: CrawlerConfig):
+        self.allowed_schemes = {scheme.lower() for scheme in config.allowed_protocols}
+        options = config.url_canonicalization
+        self.strip_trailing_slash = options.strip_trailing_slash
+        self.strip_params = {param.lower() for param in options.strip_query_params if not param.endswith("*")}
+        self.strip_prefixes = tuple(param[:-1].lower() for param in options.strip_query_params if param.endswith("*"))
+        self._cached = lru_cache(maxsize=options.cache_size)(self._canonicalize)
+
+    def canonicalize(self, url: Optional[str], base: Optional[str] = None) -> Optional[str]:
+        """The canonical absolute form of url, None if it can not be crawled (mailto:, javascript:, ...)."""
+        url = url.strip() if url else ""
+        if base:
+            try:
+                url = urljoin(base, url)
+            except ValueError:
+                return None
+        if not url:
+            return None
+        return self._cached(url)
+
+    def origin(self, url: Optional[str]) -> Optional[str]:
+        """The canonical scheme://host[:port] of url, without a path. IP table domains are stored in this form."""
+        canonical = self.canonicalize(url)
+        if canonical is None:
+            return None
+        parts = urlsplit(canonical)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+    def _keep_param(self, name: str) -> bool:
+        name = name.lower()
+        return name not in self.strip_params and not name.startswith(self.strip_prefixes)
+
+    def _normalize_path(self, path: str) -> str:
+        path = quote(_ESCAPE.sub(_normalize_escape, path), safe=_SAFE_PATH)
+        path = _remove_dot_segments(path) if path.startswith("/") else "/" + path
+        if self.strip_trailing_slash and len(path) > 1:
+            path = path.rstrip("/") or "/"
+        return path or "/"
+
+    def _normalize_query(self, query: str) -> str:
+        """Drop the stripped parameters and sort the rest, without decoding and re-encoding them.
+
+        Servers tell "?a" from "?a=" and "+" from "%20", so each raw
+        name[=value] is kept as sent, only its percent escapes are normalized.
+        """
+        if not query:
+            return ""
+        params = []
+        for param in query.split("&"):
+            if not param:
+                continue
+            # characters a query can not contain (spaces, non-ASCII) are escaped as any client would
+            param = quote(_ESCAPE.sub(_normalize_escape, param), safe=_SAFE_QUERY)
+            name, separator, value = param.partition("=")
+            if self._keep_param(unquote_plus(name)):
+                params.append((name, separator, value))
+        # sorted by name only, repeated parameters keep their order
+        return "&".join("".join(param) for param in sorted(params, key=lambda param: param[0]))
+
+    def _canonicalize(self, url: str) -> Optional[str]:
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return None
+
+        scheme = parts.scheme.lower()
+        host = parts.hostname
+        if scheme not in self.allowed_schemes or not host:
+            return None
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+        netloc = f"[{host}]" if ":" in host else host
+        if port is not None and port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{netloc}:{port}"
+
+        return urlunsplit((scheme, netloc, self._normalize_path(parts.path), self._normalize_query(parts.query), ""))
@@ -48,6 +48,17 @@ class BacklinkService(BaseService):
             setattr(updated_obj, attr, getattr(new_obj, attr))
         return updated_obj
     
+    def buffer_delete_by_source_to_target_url(self, source_url: str, target_url: str):
+        """Delete all backlinks by source to target url, in order with the buffered backlinks.
+
+        Backlinks of an earlier crawl that are still buffered are dropped
+        instead of being written after the delete.
+        """
+        if self.write_buffer is None:
+            self.delete_backlinks_by_source_to_target_url(source_url, target_url)
+            return
+        self.write_buffer.delete(BacklinkTable, source_url=source_url, target_url=target_url)
+
     def delete_backlinks_by_source_to_target_url(self, source_url: str, target_url: str) -> List[BacklinkTable]:
         """Delete all backlinks by source to target url from the database."""
         session = self.db_adapter.get_session()
@@ -0,0 +1,46 @@
+import hashlib
+from typing import Optional
+
+from src.database.adapter import DBAdapter
+from src.models import BlobTable
+from src.services import BaseService
+
+
+class BlobService(BaseService):
+    def __init__(self, db_adapter: DBAdapter):
+        super().__init__(db_adapter)
+        self.base_type = BlobTable
+
+    @staticmethod
+    def hash_content(data: bytes) -> str:
+        """Return the content address of the given bytes."""
+        return hashlib.sha256(data).hexdigest()
+
+    def put(self, data: Optional[bytes]) -> Optional[str]:
+        """Store the bytes once and return their hash. Identical content is only stored once."""
+        if not data:
+            return None
+        session = self.db_adapter.get_session()
+        content_hash = self.hash_content(data)
+        if session.get(BlobTable, content_hash) is None:
+            session.add(BlobTable(hash=content_hash, size=len(data), data=data))
+        return content_hash
+
+    def get(self, content_hash: Optional[str]) -> Optional[bytes]:
+        """Load the bytes of a blob by its hash."""
+        if not content_hash:
+            return None
+        session = self.db_adapter.get_session()
+        blob = session.get(BlobTable, content_hash)
+        return blob.data if blob else None
+
+    def exists(self, content_hash: str) -> bool:
+        """Check if a blob exists without loading its content."""
+        session = self.db_adapter.get_session()
+        return session.query(BlobTable.hash).filter(BlobTable.hash == content_hash).first() is not None
+
+    def get_size(self, content_hash: str) -> Optional[int]:
+        """Return the size of a blob without loading its content."""
+        session = self.db_adapter.get_session()
+        row = session.query(BlobTable.size).filter(BlobTable.hash == content_hash).first()
+        return row[0] if row else None
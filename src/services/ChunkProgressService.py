@@ -0,0 +1,76 @@
+from datetime import datetime
+from typing import List, Optional
+
+from src.database.adapter import DBAdapter
+from src.models import ChunkProgressTable, ChunkStatus
+from src.services import BaseService
+
+
+class ChunkProgressService(BaseService):
+    def __init__(self, db_adapter: DBAdapter):
+        super().__init__(db_adapter)
+        self.base_type = ChunkProgressTable
+
+    @staticmethod
+    def chunk_key(chunk: tuple[tuple[int, int], ...]) -> str:
+        """example ((0, 8), (8, 16), (0, 8), (0, 8)) -> 0-8.8-16.0-8.0-8"""
+        return ".".join(f"{start}-{end}" for start, end in chunk)
+
+    @staticmethod
+    def parse_chunk_key(key: str) -> tuple[tuple[int, int], ...]:
+        return tuple(tuple(int(octet) for octet in part.split("-")) for part in key.split("."))
+
+    def get_progress(self, chunk: tuple[tuple[int, int], ...]) -> Optional[ChunkProgressTable]:
+        """Get the ledger entry of a chunk."""
+        session = self.db_adapter.get_session()
+        return session.get(ChunkProgressTable, self.chunk_key(chunk))
+
+    def get_chunk_keys_by_status(self, status: ChunkStatus) -> set[str]:
+        """Get the keys of all chunks in the given state."""
+        session = self.db_adapter.get_session()
+        rows = session.query(ChunkProgressTable.chunk).filter(ChunkProgressTable.status == status.value).all()
+        return {row[0] for row in rows}
+
+    def get_progresses(self) -> List[ChunkProgressTable]:
+        """Get all ledger entries."""
+        session = self.db_adapter.get_session()
+        return session.query(ChunkProgressTable).all()
+
+    def start(self, chunk: tuple[tuple[int, int], ...]) -> ChunkProgressTable:
+        """Mark a chunk as in progress, keeping the checkpoint of an interrupted earlier run."""
+        session = self.db_adapter.get_session()
+        progress = self.get_progress(chunk)
+        if not progress:
+            progress = ChunkProgressTable(chunk=self.chunk_key(chunk), checkpoint=0, hit_count=0)
+            session.add(progress)
+        progress.status = ChunkStatus.IN_PROGRESS.value
+        progress.started_at = progress.started_at or datetime.now()
+        return progress
+
+    def checkpoint(self, chunk: tuple[tuple[int, int], ...], checkpoint: int, hits: int = 0) -> ChunkProgressTable:
+        """Record that the first `checkpoint` addresses of a chunk are scanned."""
+        progress = self.get_progress(chunk) or self.start(chunk)
+        progress.checkpoint = max(progress.checkpoint or 0, checkpoint)
+        progress.hit_count = (progress.hit_count or 0) + hits
+        progress.checkpointed_at = datetime.now()
+        return progress
+
+    def finish(self, chunk: tuple[tuple[int, int], ...], hits: int = 0) -> ChunkProgressTable:
+        """Mark a chunk as done."""
+        progress = self.get_progress(chunk) or self.start(chunk)
+        progress.status = ChunkStatus.DONE.value
+        progress.hit_count = (progress.hit_count or 0) + hits
+        progress.finished_at = datetime.now()
+        return progress
+
+    def reset(self, chunk: tuple[tuple[int, int], ...]) -> Optional[ChunkProgressTable]:
+        """Move a chunk back to pending so it is scanned from scratch."""
+        progress = self.get_progress(chunk)
+        if progress:
+            progress.status = ChunkStatus.PENDING.value
+            progress.checkpoint = 0
+            progress.hit_count = 0
+            progress.started_at = None
+            progress.checkpointed_at = None
+            progress.finished_at = None
+        return progress
@@ -1,4 +1,4 @@
-from sqlalchemy import union_all
+from sqlalchemy import select
 from src.models import DocumentIndexTableBase
 from src.services import PartitionedService 
 
@@ -30,8 +30,8 @@ class DocumentIndexService(PartitionedService):
                 session.commit()
         return obj
     
-    def get_document_indices(self) -> list[DocumentIndexTableBase]:
-        """Get all document indices from the database."""
+    def get_document_indices(self) -> list[tuple]:
+        """Get all document indices from the database, as row tuples."""
         return self.get_all()
     
     def get_document_indices_by_word(self, word: str, starting_with=False) -> list[DocumentIndexTableBase]:
@@ -43,19 +43,17 @@ class DocumentIndexService(PartitionedService):
             return session.query(DynamicModel).filter(DynamicModel.word.startswith(word)).all()
         return session.query(DynamicModel).filter_by(word=word).all()
     
-    def get_document_indices_by_multiple_words(self, words: list[str]) -> list[DocumentIndexTableBase]:
-        queries = []
-        for key in self.base_type.partition_keys + ["default"]:
-            table_name = f"{self.base_type.__basename__}_{key}"
-            DynamicTable = self.get_model(table_name)
-            query = self.db_adapter.get_session().query(DynamicTable).filter(
-                DynamicTable.word.in_(words)
-            )
-            queries.append(query)
-        
-        fetch_all_query = union_all(*queries)
-        result = self.db_adapter.get_session().execute(fetch_all_query).fetchall()
-        return self.rows_to_objects(result)
+    def get_document_indices_by_multiple_words(self, words: list[str]) -> list[tuple]:
+        """Get the document indices of any of the words, as row tuples."""
+        # only the partitions of the given words are queried, each for its own words
+        fetch_query = self.union_partitions(
+            lambda DynamicTable, table_words: select(DynamicTable).where(DynamicTable.word.in_(table_words)),
+            keys=words,
+        )
+        if fetch_query is None:
+            return []
+        result = self.db_adapter.get_session().execute(fetch_query).fetchall()
+        return self.rows_to_tuples(result)
 
     def update_document_index(self, new_obj: DocumentIndexTableBase) -> DocumentIndexTableBase:
         """Update an existing document index in the database."""
@@ -87,18 +85,21 @@ class DocumentIndexService(PartitionedService):
         
         return True
 
-    def get_document_indices_by_document_url(self, document_url: int) -> list[DocumentIndexTableBase]:
-        """Get all document indices by document_url from the database."""
-    
-        queries = []
+    def delete_document_indices_by_document_url(self, document_url: str) -> bool:
+        """Delete all document indices of a document from every partition."""
+        session = self.db_adapter.get_session()
         for key in self.base_type.partition_keys + ["default"]:
             table_name = f"{self.base_type.__basename__}_{key}"
             DynamicTable = self.get_model(table_name)
-            query = self.db_adapter.get_session().query(DynamicTable).filter_by(
-                document_url=document_url
-            )
-            queries.append(query)
-        
-        fetch_all_query = union_all(*queries)
+            session.query(DynamicTable).filter_by(document_url=document_url).delete(synchronize_session=False)
+        return True
+
+    def get_document_indices_by_document_url(self, document_url: int) -> list[tuple]:
+        """Get all document indices by document_url from the database, as row tuples."""
+    
+        # partitioned by word, any partition can hold words of the document
+        fetch_all_query = self.union_partitions(
+            lambda DynamicTable, _: select(DynamicTable).where(DynamicTable.document_url == document_url)
+        )
         result = self.db_adapter.get_session().execute(fetch_all_query).fetchall()
-        return self.rows_to_objects(result)
+        return self.rows_to_tuples(result)
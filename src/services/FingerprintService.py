@@ -0,0 +1,141 @@
+import ipaddress
+from datetime import datetime
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from sqlalchemy import delete, or_, select, update
+
+from src.database.adapter import DBAdapter
+from src.models import PageFingerprintTable
+from src.modules.simhash import bands, hamming_distance, probe_radius, probes, to_signed, to_unsigned
+from src.services import BaseService
+from src.utils import config
+
+
+class FingerprintResult(NamedTuple):
+    """What fingerprinting a page changed about the near-duplicate clusters."""
+    canonical_url: Optional[str]  # representative of the page's cluster, None if that is the page itself
+    demoted: list[str]  # former representatives that are now duplicates of another page
+    released: list[str]  # former duplicates without a representative, they need their body back
+
+
+class FingerprintService(BaseService):
+    """Groups near-duplicate pages into clusters with one canonical page each.
+
+    The representative of a cluster is its preferred url (see `preference`),
+    whatever the order the pages were crawled in. Duplicates always point
+    straight to it: merging clusters or a better url joining one re-points
+    all of them, and a representative that changes or disappears releases
+    the pages that pointed to it.
+    """
+    def __init__(self, db_adapter: DBAdapter, max_distance: int = None):
+        super().__init__(db_adapter)
+        self.base_type = PageFingerprintTable
+        self.max_distance = config.crawler.near_duplicate_distance if max_distance is None else max_distance
+        self.radius = probe_radius(self.max_distance)
+
+    @staticmethod
+    def preference(url: str) -> tuple:
+        """Sort key of the urls of a cluster, lowest first: domains over raw IPs, https, then the shortest."""
+        parts = urlsplit(url)
+        try:
+            ipaddress.ip_address(parts.hostname or "")
+            is_ip = True
+        except ValueError:
+            is_ip = False
+        return is_ip, parts.scheme != "https", len(url), url
+
+    def _resolve(self, page_url: str) -> str:
+        """The end of a canonical_url chain, chains left by older versions are followed."""
+        seen = {page_url}
+        while (canonical_url := self.get_canonical_url(page_url)) and canonical_url not in seen:
+            seen.add(canonical_url)
+            page_url = canonical_url
+        return page_url
+
+    def _repoint(self, session, canonical_url: str, new_canonical_url: Optional[str]):
+        table = PageFingerprintTable
+        session.execute(
+            update(table).where(table.canonical_url == canonical_url).values(canonical_url=new_canonical_url)
+        )
+
+    def find_canonical_url(self, page_url: str, fingerprint: int) -> Optional[str]:
+        """The representative of the cluster a fingerprint falls into, None if the page would represent it."""
+        roots = self._find_roots(page_url, fingerprint)
+        best = min(roots | {page_url}, key=self.preference)
+        return None if best == page_url else best
+
+    def _find_roots(self, page_url: str, fingerprint: int) -> set[str]:
+        """The representatives of every cluster within `max_distance` of a fingerprint."""
+        table = PageFingerprintTable
+        session = self.db_adapter.get_session()
+        # each band is looked up at every value within `radius` bits, see src.modules.simhash
+        page_probes = [probes(value, self.radius) for value in bands(fingerprint)]
+        query = (
+            select(table.page_url, table.simhash, table.canonical_url)
+            .where(
+                table.page_url != page_url,
+                or_(*(getattr(table, f"band_{band}").in_(values) for band, values in enumerate(page_probes))),
+            )
+        )
+        roots = set()
+        for row in session.execute(query):
+            if hamming_distance(fingerprint, to_unsigned(row.simhash)) <= self.max_distance:
+                roots.add(self._resolve(row.canonical_url or row.page_url))
+        roots.discard(page_url)
+        return roots
+
+    def fingerprint(self, page_url: str, fingerprint: int) -> FingerprintResult:
+        """Store the fingerprint of a page and fold it into the cluster of its near-duplicates."""
+        table = PageFingerprintTable
+        session = self.db_adapter.get_session()
+        roots = self._find_roots(page_url, fingerprint)
+        best = min(roots | {page_url}, key=self.preference)
+
+        # every other cluster the page falls into merges into the one of `best`
+        demoted = sorted(roots - {best})
+        for root in demoted:
+            session.execute(update(table).where(table.page_url == root).values(canonical_url=best))
+            self._repoint(session, root, best)
+
+        # pages that pointed to this one stay in the cluster while they are still near it
+        released = []
+        duplicates = session.execute(select(table.page_url, table.simhash).where(table.canonical_url == page_url))
+        for duplicate in duplicates.all():
+            if hamming_distance(fingerprint, to_unsigned(duplicate.simhash)) <= self.max_distance:
+                if best != page_url:
+                    session.execute(update(table).where(table.page_url == duplicate.page_url).values(canonical_url=best))
+            else:
+                released.append(duplicate.page_url)
+        if released:
+            session.execute(update(table).where(table.page_url.in_(released)).values(canonical_url=None))
+
+        row = session.get(PageFingerprintTable, page_url)
+        if row is None:
+            row = PageFingerprintTable(page_url=page_url)
+            session.add(row)
+        row.simhash = to_signed(fingerprint)
+        for band, value in enumerate(bands(fingerprint)):
+            setattr(row, f"band_{band}", value)
+        row.canonical_url = None if best == page_url else best
+        row.updated_at = datetime.now()
+        return FingerprintResult(row.canonical_url, demoted, released)
+
+    def remove(self, page_url: str) -> list[str]:
+        """Forget the fingerprint of a page that is gone or no longer valid, returns the duplicates it released."""
+        table = PageFingerprintTable
+        session = self.db_adapter.get_session()
+        released = self.get_duplicates(page_url)
+        self._repoint(session, page_url, None)
+        session.execute(delete(table).where(table.page_url == page_url))
+        return released
+
+    def get_canonical_url(self, page_url: str) -> Optional[str]:
+        """The representative of the page's cluster, None if the page is not a known duplicate."""
+        session = self.db_adapter.get_session()
+        return session.scalar(select(PageFingerprintTable.canonical_url).where(PageFingerprintTable.page_url == page_url))
+
+    def get_duplicates(self, canonical_url: str) -> list[str]:
+        """The urls of the pages clustered under a canonical page."""
+        session = self.db_adapter.get_session()
+        return list(session.scalars(select(PageFingerprintTable.page_url).where(PageFingerprintTable.canonical_url == canonical_url)))
@@ -0,0 +1,129 @@
+from datetime import datetime
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import MetaData, Table, inspect, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.database.adapter import DBAdapter
+from src.database.schema_upgrade import drop_column
+from src.models import HostTable, PageTableBase
+from src.services import BaseService
+from src.services.BlobService import BlobService
+
+
+class HostService(BaseService):
+    artifacts = ("favicon", "robotstxt", "sitemap")
+
+    def __init__(self, db_adapter: DBAdapter):
+        super().__init__(db_adapter)
+        self.base_type = HostTable
+        self.blob_service = BlobService(db_adapter)
+
+    @staticmethod
+    def get_host_key(url: str) -> str:
+        """example https://www.google.com/products/1 -> https://www.google.com"""
+        parsed_uri = urlparse(url)
+        return f"{parsed_uri.scheme}://{parsed_uri.netloc}".lower()
+
+    def get_hosts(self) -> List[HostTable]:
+        """Get all hosts from the database. Artifact contents are not loaded."""
+        session = self.db_adapter.get_session()
+        return session.query(HostTable).all()
+
+    def get_host(self, url: str) -> Optional[HostTable]:
+        """Get the host row of the url. Artifact contents are not loaded."""
+        session = self.db_adapter.get_session()
+        return session.get(HostTable, self.get_host_key(url))
+
+    def upsert_host(self, url: str, favicon: Optional[bytes] = None, robotstxt: Optional[bytes] = None,
+                    sitemap: Optional[bytes] = None) -> HostTable:
+        """Store the artifacts of the url's host in the blob store and reference them from the host row."""
+        session = self.db_adapter.get_session()
+        host_obj = self.get_host(url)
+        if not host_obj:
+            host_obj = HostTable(host=self.get_host_key(url))
+            session.add(host_obj)
+
+        host_obj.favicon_hash = self.blob_service.put(favicon) or host_obj.favicon_hash
+        host_obj.robotstxt_hash = self.blob_service.put(robotstxt) or host_obj.robotstxt_hash
+        host_obj.sitemap_hash = self.blob_service.put(sitemap) or host_obj.sitemap_hash
+        host_obj.last_updated = datetime.now()
+        return host_obj
+
+    def import_page_artifacts(self) -> int:
+        """Move the artifacts older versions kept on every page row into the host rows and the blob store.
+
+        The first page of a host with an artifact provides it, artifacts a host
+        row already has win. The legacy page columns are dropped once a table
+        is done, so this only does work on the first start after an upgrade.
+        Returns the number of hosts updated.
+        """
+        engine = self.db_adapter.engine
+        inspector = inspect(engine)
+        updated = 0
+        for table_name in inspector.get_table_names():
+            if not table_name.startswith(f"{PageTableBase.__basename__}_"):
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table_name)}
+            legacy = [artifact for artifact in self.artifacts if artifact in columns]
+            if not legacy:
+                continue
+
+            table = Table(table_name, MetaData(), autoload_with=engine)
+            try:
+                with self.unit_of_work() as session:
+                    has_artifact = or_(*(table.c[artifact] != None for artifact in legacy))
+                    # urls first, the contents are only read for one page per host
+                    first_pages = {}
+                    for page_url in session.scalars(select(table.c.page_url).where(has_artifact)):
+                        first_pages.setdefault(self.get_host_key(page_url), page_url)
+                    for page_url in first_pages.values():
+                        row = session.execute(
+                            select(*(table.c[artifact] for artifact in legacy)).where(table.c.page_url == page_url)
+                        ).one()
+                        host_obj = self.get_host(page_url)
+                        if not host_obj:
+                            host_obj = HostTable(host=self.get_host_key(page_url), last_updated=datetime.now())
+                            session.add(host_obj)
+                        for artifact, data in zip(legacy, row):
+                            if getattr(host_obj, f"{artifact}_hash") is None:
+                                setattr(host_obj, f"{artifact}_hash", self.blob_service.put(data))
+                    session.flush()
+                    for artifact in legacy:
+                        drop_column(session.connection(), table, artifact)
+            except SQLAlchemyError as e:
+                # another crawler may be moving the same table
+                print(f"Could not move the host artifacts out of {table_name}:", e.__class__.__name__, e)
+                continue
+            updated += len(first_pages)
+            print(f"Moved the favicon, robots.txt and sitemap of {len(first_pages)} hosts out of {table_name}")
+        return updated
+
+    def _load_artifact(self, url: str, artifact: str) -> Optional[bytes]:
+        if artifact not in self.artifacts:
+            raise ValueError(f"Unknown host artifact: {artifact}")
+        host_obj = self.get_host(url)
+        if not host_obj:
+            return None
+        return self.blob_service.get(getattr(host_obj, f"{artifact}_hash"))
+
+    def get_favicon(self, url: str) -> Optional[bytes]:
+        """Lazily load the favicon of the url's host."""
+        return self._load_artifact(url, "favicon")
+
+    def get_robotstxt(self, url: str) -> Optional[bytes]:
+        """Lazily load the robots.txt of the url's host."""
+        return self._load_artifact(url, "robotstxt")
+
+    def get_sitemap(self, url: str) -> Optional[bytes]:
+        """Lazily load the sitemap of the url's host."""
+        return self._load_artifact(url, "sitemap")
+
+    def delete_host(self, url: str) -> Optional[HostTable]:
+        """Delete a host row. Blobs are kept since other hosts may reference them."""
+        session = self.db_adapter.get_session()
+        host_obj = self.get_host(url)
+        if host_obj:
+            session.delete(host_obj)
+        return host_obj
@@ -1,7 +1,7 @@
-from typing import List, Optional
+from typing import Callable, List, Optional
 from datetime import datetime
 
-from sqlalchemy import func, select, union_all
+from sqlalchemy import func
 
 from src.models import IPTableBase
 from src.services import PartitionedService
@@ -21,19 +21,18 @@ class IPService(PartitionedService):
         session.add(ip_obj)
         return DynamicModel
     
-    def get_unscanned_ips(self):
-        queries = []
-        for key in self.base_type.partition_keys + ["default"]:
-            table_name = f"{self.base_type.__basename__}_{key}"
-            DynamicTable = self.get_model(table_name)
-            query = select(DynamicTable).where(DynamicTable.last_crawled == None)
-            queries.append(query)
-
-        fetch_all_query = union_all(*queries)
+    def get_unscanned_ips(self, columns=None):
+        fetch_all_query = self.union_partitions(
+            lambda DynamicTable, _: self.select_columns(DynamicTable, columns).where(DynamicTable.last_crawled == None)
+        )
         result = self.db_adapter.get_session().execute(fetch_all_query).all()
-        rows = self.rows_to_objects(result)
+        rows = self.rows_to_tuples(result, columns)
         return rows
 
+    def sample_unscanned_ips(self, limit: int, columns=None) -> List[tuple]:
+        """Get up to `limit` random unscanned IPs, reading O(limit) rows."""
+        return self.sample(lambda DynamicTable: DynamicTable.last_crawled == None, limit, columns)
+
     def safe_add_url(self, ip_obj: IPTableBase) -> bool:
         """Add a new IP to the database if it does not already exist."""
         session = self.db_adapter.get_session()
@@ -45,9 +44,9 @@ class IPService(PartitionedService):
             return True
         return False
 
-    def get_ips(self) -> List[IPTableBase]:
-        """Get all IPs from the database."""
-        return self.get_all()
+    def get_ips(self, columns=None) -> List[tuple]:
+        """Get all IPs from the database, as row tuples of the given columns."""
+        return self.get_all(columns)
     
     def get_ip_by_domain(self, domain: str) -> IPTableBase:
         """Get all IPs with a specific domain from the database."""
@@ -56,6 +55,26 @@ class IPService(PartitionedService):
         DynamicTable = self.get_model(table)
         return session.query(DynamicTable).filter(DynamicTable.domain==domain).first() # TODO could there be multiple domains with different ip's? 
 
+    def normalize_domains(self, normalize: Callable[[str], Optional[str]]) -> int:
+        """Rewrite domains stored in an older form, e.g. with a path or a trailing slash, to normalize(domain).
+
+        A row whose normalized domain is already stored is dropped, the stored
+        one wins. Returns the number of rows rewritten or dropped.
+        """
+        session = self.db_adapter.get_session()
+        changed = 0
+        for row in self.get_ips():
+            domain = normalize(row.domain)
+            if not domain or domain == row.domain:
+                continue
+            # the normalized domain may belong to another partition, move the row
+            OldTable = self.get_model(IPTableBase.get_partition_tablename(row.domain))
+            session.query(OldTable).filter(OldTable.domain == row.domain).delete(synchronize_session=False)
+            if not self.get_ip_by_domain(domain):
+                session.add(self.to_object(row._replace(domain=domain)))
+            changed += 1
+        return changed
+
     def update_ip(self, new_obj: IPTableBase) -> IPTableBase:
         """Update an existing IP in the database."""
         session = self.db_adapter.get_session()
@@ -73,18 +92,13 @@ class IPService(PartitionedService):
         
         return updated_obj
 
-    def get_valid_ips(self):
-        queries = []
-        for key in self.base_type.partition_keys + ["default"]:
-            table_name = f"{self.base_type.__basename__}_{key}"
-            DynamicTable = self.get_model(table_name)
-            query = self.db_adapter.get_session().query(DynamicTable).filter_by(status=200)
-            queries.append(query)
-        
-        fetch_all_query = union_all(*queries)
+    def get_valid_ips(self, columns=None):
+        fetch_all_query = self.union_partitions(
+            lambda DynamicTable, _: self.select_columns(DynamicTable, columns).where(DynamicTable.status == 200)
+        )
         result = self.db_adapter.get_session().execute(fetch_all_query).fetchall()
 
-        return self.rows_to_objects(result)
+        return self.rows_to_tuples(result, columns)
     
     def upsert_ip(self, new_ip_obj:IPTableBase) -> IPTableBase:
         """Add a new IP or update an existing one in the database."""
@@ -0,0 +1,110 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from src.database.adapter import DBAdapter
+from src.models import WorkLeaseTable
+from src.services import BaseService
+from src.utils import config
+
+
+class LeaseService(BaseService):
+    """Distributes crawl work between machines through expiring leases.
+
+    A claim succeeds only if the item has no lease or its lease expired, and
+    every claim is committed on its own short lived session. Two workers can
+    never hold the same item at once, and the items of a dead worker become
+    claimable again once its leases expire.
+    """
+    def __init__(self, db_adapter: DBAdapter, owner_id: str = None, ttl_seconds: int = None):
+        super().__init__(db_adapter)
+        self.base_type = WorkLeaseTable
+        self.owner_id = owner_id or f"{config.system.machine_id}:{socket.gethostname()}:{os.getpid()}"
+        self.ttl = timedelta(seconds=ttl_seconds or config.system.lease_ttl_seconds)
+
+    def claim(self, kind: str, items: List[str], limit: int = None) -> List[str]:
+        """Claim up to `limit` of the given items, returns the claimed ones in order."""
+        claimed = []
+        with self.db_adapter.get_session(persistent=False) as session:
+            for item in items:
+                if limit is not None and len(claimed) >= limit:
+                    break
+                now = datetime.now()
+                # take over an expired lease
+                result = session.execute(
+                    update(WorkLeaseTable)
+                    .where(WorkLeaseTable.kind == kind,
+                           WorkLeaseTable.item == item,
+                           WorkLeaseTable.expires_at < now)
+                    .values(owner=self.owner_id, expires_at=now + self.ttl)
+                )
+                if result.rowcount:
+                    session.commit()
+                    claimed.append(item)
+                    continue
+                # or create a new one, the primary key rejects items leased by someone else
+                try:
+                    session.add(WorkLeaseTable(kind=kind, item=item, owner=self.owner_id, expires_at=now + self.ttl))
+                    session.commit()
+                    claimed.append(item)
+                except IntegrityError:
+                    session.rollback()
+        return claimed
+
+    def claim_one(self, kind: str, item: str) -> bool:
+        return bool(self.claim(kind, [item]))
+
+    def renew(self, kind: str, items: List[str]) -> int:
+        """Extend the leases this owner holds, returns how many are still held."""
+        if not items:
+            return 0
+        with self.db_adapter.get_session(persistent=False) as session:
+            result = session.execute(
+                update(WorkLeaseTable)
+                .where(WorkLeaseTable.kind == kind,
+                       WorkLeaseTable.item.in_(items),
+                       WorkLeaseTable.owner == self.owner_id)
+                .values(expires_at=datetime.now() + self.ttl)
+            )
+            session.commit()
+            return result.rowcount
+
+    def release(self, kind: str, items: List[str]) -> int:
+        """Give back leases this owner holds."""
+        if not items:
+            return 0
+        with self.db_adapter.get_session(persistent=False) as session:
+            result = session.execute(
+                delete(WorkLeaseTable)
+                .where(WorkLeaseTable.kind == kind,
+                       WorkLeaseTable.item.in_(items),
+                       WorkLeaseTable.owner == self.owner_id)
+            )
+            session.commit()
+            return result.rowcount
+
+    def release_all(self) -> int:
+        """Give back every lease this owner holds, e.g. on shutdown."""
+        with self.db_adapter.get_session(persistent=False) as session:
+            result = session.execute(delete(WorkLeaseTable).where(WorkLeaseTable.owner == self.owner_id))
+            session.commit()
+            return result.rowcount
+
+    def purge_expired(self) -> int:
+        """Delete expired leases of any owner."""
+        with self.db_adapter.get_session(persistent=False) as session:
+            result = session.execute(delete(WorkLeaseTable).where(WorkLeaseTable.expires_at < datetime.now()))
+            session.commit()
+            return result.rowcount
+
+    def get_leases(self, kind: str = None) -> List[WorkLeaseTable]:
+        """Get all leases, optionally of a single kind."""
+        session = self.db_adapter.get_session()
+        query = session.query(WorkLeaseTable)
+        if kind:
+            query = query.filter(WorkLeaseTable.kind == kind)
+        return query.all()
@@ -1,74 +1,146 @@
 from typing import List, Optional
 from datetime import datetime
-from sqlalchemy import func, select, union_all
+from sqlalchemy import Column
+from sqlalchemy.orm import defer
 
 from src.models import PageTableBase
+from src.modules.body_codec import BodyCodec
+from src.modules.recrawl_scheduler import RecrawlScheduler
 from src.services import PartitionedService
+from src.utils import config
 
 
 class PageService(PartitionedService):
+    # every column but the body, for reads that only schedule or describe pages
+    light_columns = tuple(
+        name for name, value in vars(PageTableBase).items() if isinstance(value, Column) and name != "body"
+    )
+
     def __init__(self, db_adapter):
         super().__init__(db_adapter)
         self.base_type = PageTableBase
+        self.codec = BodyCodec(config.storage.body_codec, config.storage.body_compression_level)
+
+    def encode_body(self, page: PageTableBase) -> PageTableBase:
+        """Compress the page body in place before it is written."""
+        page.body = self.codec.encode(page.body)
+        return page
+
+    def buffer_upsert(self, obj: PageTableBase) -> bool:
+        return super().buffer_upsert(self.encode_body(obj))
+
+    def buffer_insert(self, obj: PageTableBase) -> bool:
+        return super().buffer_insert(self.encode_body(obj))
+
+    def get_body(self, page: PageTableBase) -> Optional[bytes]:
+        """Return the decompressed body of a page. Bodies stay compressed on the row until asked for."""
+        return self.codec.decode(page.body)
     
-    def get_pages(self) -> List[PageTableBase]:
-        """Get all pages from the database."""
-        return self.get_all()
+    def get_pages(self, columns=None) -> List[tuple]:
+        """Get all pages from the database, as row tuples of the given columns."""
+        return self.get_all(columns)
     
-    def get_unscanned_pages(self):
-        queries = []
-        for key in self.base_type.partition_keys + ["default"]:
-            table_name = f"{self.base_type.__basename__}_{key}"
-            DynamicTable = self.get_model(table_name)
-            query = select(DynamicTable).where(DynamicTable.last_crawled == None)
-            queries.append(query)
-
-        fetch_all_query = union_all(*queries)
+    def get_unscanned_pages(self, columns=None):
+        fetch_all_query = self.union_partitions(
+            lambda DynamicTable, _: self.select_columns(DynamicTable, columns).where(DynamicTable.last_crawled == None)
+        )
         rows = self.db_adapter.get_session().execute(fetch_all_query).all()
-        rows = self.rows_to_objects(rows)
+        rows = self.rows_to_tuples(rows, columns)
         return rows
     
-    def generate_page_obj(self, page_url, title, status_code, keywords, description, body, favicon, robotstxt, sitemap, last_crawled):
-        tablename = self.base_type.get_partition_tablename(page_url)
-        PageTable = self.get_model(tablename)
-        return PageTable(
+    def sample_unscanned_pages(self, limit: int, columns=None) -> List[tuple]:
+        """Get up to `limit` random unscanned pages, reading O(limit) rows."""
+        return self.sample(lambda DynamicTable: DynamicTable.last_crawled == None, limit, columns)
+
+    def get_due_pages(self, limit: int = None, now: datetime = None, columns=None) -> List[tuple]:
+        """Get crawled pages whose next_crawl time has passed, most overdue first, as row tuples.
+
+        A projection always includes next_crawl, the rows are sorted by it.
+        """
+        now = now or datetime.now()
+        if columns is not None and "next_crawl" not in columns:
+            columns = (*columns, "next_crawl")
+        build_query = lambda DynamicTable, _: (
+            self.select_columns(DynamicTable, columns).where(DynamicTable.next_crawl <= now)
+        )
+        if limit is not None:
+            # each partition is cut to `limit` rows on the next_crawl index
+            return self.fetch_first(
+                lambda DynamicTable, keys: build_query(DynamicTable, keys).order_by(DynamicTable.next_crawl),
+                limit,
+                sort_key=lambda row: row.next_crawl,
+                columns=columns,
+            )
+        fetch_all_query = self.union_partitions(build_query).order_by("next_crawl")
+        rows = self.db_adapter.get_session().execute(fetch_all_query).all()
+        return self.rows_to_tuples(rows, columns)
+
+    def generate_page_obj(self, page_url, title, status_code, keywords, description, body, last_crawled):
+        return self.generate_obj(
+            "page_url",
             page_url=page_url,
             title=title,
             status_code=status_code,
             keywords=keywords,
             description=description,
-            body=body,
-            favicon=favicon,
-            robotstxt=robotstxt,
-            sitemap=sitemap,
+            body=self.codec.encode(body),
             last_crawled=last_crawled,
         )
     
     
     def count_unscanned_pages(self):
         """Count the number of unscanned pages."""
-        total = 0
-        for key in self.base_type.partition_keys + ["default"]:
-            table_name = f"{self.base_type.__basename__}_{key}"
-            DynamicTable = self.db_adapter.get_model(table_name, self.base_type)
-            stmt = self.db_adapter.get_session().query(func.count()).select_from(DynamicTable).filter(DynamicTable.last_crawled == None)
-            total += stmt.scalar()
-        return total
-
-    def get_page(self, page_url: str) -> Optional[PageTableBase]:
-        """Get a specific page from the database."""
+        return self.stats().unscanned_count
+
+    def get_page(self, page_url: str, columns=None) -> Optional[PageTableBase]:
+        """Get a specific page from the database.
+
+        With columns, only those are read and a row tuple is returned.
+        Otherwise the ORM object is returned, its body is only loaded once
+        it is accessed.
+        """
         session = self.db_adapter.get_session()
         table = PageTableBase.get_partition_tablename(page_url)
         model = self.get_model(table)
-        page = session.query(model).filter(model.page_url == page_url).first()
+        if columns is not None:
+            query = self.select_columns(model, columns).where(model.page_url == page_url).limit(1)
+            rows = self.rows_to_tuples(session.execute(query), columns)
+            return rows[0] if rows else None
+        page = session.query(model).options(defer(model.body)).filter(model.page_url == page_url).first()
         return page
     
+    def update_clusters(self, scheduler: RecrawlScheduler, demoted: List[str] = (), released: List[str] = ()):
+        """Apply near-duplicate cluster changes (see FingerprintService) to the stored pages.
+
+        Demoted pages became near-duplicates, their bodies are dropped. Released
+        pages lost their canonical page and are due again to get their bodies
+        back, their validators are cleared so the crawl does not take them as
+        unchanged.
+        """
+        now = datetime.now()
+        for url in demoted:
+            for page in self._stored_and_buffered(url):
+                page.body = None
+                scheduler.mark_duplicate(page, now=now)
+        for url in released:
+            for page in self._stored_and_buffered(url):
+                page.etag = page.last_modified = page.content_hash = None
+                page.next_crawl = now
+
+    def _stored_and_buffered(self, page_url: str) -> List[PageTableBase]:
+        """The stored page of a url and the one waiting in the write buffer, the latter overwrites the former."""
+        pages = [self.get_page(page_url)]
+        if self.write_buffer is not None:
+            model = self.get_model(PageTableBase.get_partition_tablename(page_url))
+            pages.append(self.write_buffer.get(model, page_url))
+        return [page for page in pages if page is not None]
+
     def add_page(self, new_obj: PageTableBase) -> PageTableBase:
         """Add a new page to the database."""
         session = self.db_adapter.get_session()
         table = PageTableBase.get_partition_tablename(new_obj.page_url)
         DynamicModel = self.get_model(table)
-        session.add(new_obj)
+        session.add(self.encode_body(new_obj))
         return DynamicModel
 
     def update_page(self, new_obj: PageTableBase) -> PageTableBase:
@@ -82,6 +154,7 @@ class PageService(PartitionedService):
         if not updated_obj:
             raise ValueError(f"Cant find page with url: {new_obj.page_url} in the database.")
 
+        self.encode_body(new_obj)
         for attr in [attr for attr in dir(new_obj) if not attr.startswith("_")  and attr not in ["created_at", "updated_at"]]:
             setattr(updated_obj, attr, getattr(new_obj, attr))
         setattr(updated_obj, "updated_at", datetime.now())
@@ -1,42 +1,115 @@
 import time
+from contextlib import contextmanager
 
 from sqlalchemy.exc import OperationalError as saOperationalError
 from sqlite3 import OperationalError as slOperationalError
 from src.database.adapter import DBAdapter
+from src.database.write_buffer import WriteBehindBuffer, jittered_backoff
 from src.models import Base
+from src.utils import config
 
 class BaseService:
     def __init__(self, db_adapter: DBAdapter):
         """Initialize the BaseService with a DBAdapter."""
         self.db_adapter = db_adapter
-        Base.metadata.create_all(self.db_adapter.engine)
+        if not self.db_adapter.read_only:
+            Base.metadata.create_all(self.db_adapter.engine)
         self.base_type = None # Set this in the child class
+        self.write_buffer = None
 
     def _commit(self) -> bool:
-        session = self.db_adapter.get_session()        
-        max_retries = 5
-        retries = 5
-        wait = 5
-        while retries > 0:
+        session = self.db_adapter.get_session()
+        max_retries = config.storage.commit_max_retries
+        attempts, error = 0, None
+        for attempts in range(1, max_retries + 1):
             try:
                 session.commit()
+                self.db_adapter.mark_written(session)
                 return True
-            except (saOperationalError, slOperationalError):
-                print("Database locked, waiting...")
+            except (saOperationalError, slOperationalError) as e:
+                error = e
+                wait = jittered_backoff(attempts - 1)
+                print(f"Database locked, waiting {wait:.2f}s...")
                 session.rollback()
                 print("Session rolled back.")
                 time.sleep(wait)
             except Exception as e:
-                print("Error committing changes, retrying:", e.__class__.__name__, e)
-                retries -= 1
-                session.rollback()
-                print("Session rolled back.")
-                time.sleep(wait)
+                # not transient, retrying would fail the same way
+                error = e
+                break
 
-        print(f"Failed to commit changes after {max_retries} retries.")
+        print(f"Failed to commit changes after {attempts} attempt(s):", error.__class__.__name__, error)
         session.rollback()
         return False
-    
+
+    def enable_write_behind(self, **buffer_kwargs) -> WriteBehindBuffer:
+        """Route buffer_upsert/buffer_insert of this service through a write-behind buffer."""
+        options = dict(
+            max_rows=config.storage.write_buffer_max_rows,
+            max_age_seconds=config.storage.write_buffer_max_age_seconds,
+            max_pending=config.storage.write_buffer_max_pending,
+            max_retries=config.storage.commit_max_retries,
+        )
+        options.update(buffer_kwargs)
+        self.write_buffer = WriteBehindBuffer(self.db_adapter, self.__class__.__name__, **options)
+        self.db_adapter.write_buffers.add(self.write_buffer)
+        return self.write_buffer
+
+    def buffer_upsert(self, obj) -> bool:
+        """Insert or replace a row, written in bulk by the write-behind buffer."""
+        if self.write_buffer is None:
+            self.db_adapter.get_session().merge(obj)
+            return True
+        return self.write_buffer.upsert(obj)
+
+    def buffer_insert(self, obj) -> bool:
+        """Insert a row unless it already exists, written in bulk by the write-behind buffer."""
+        if self.write_buffer is None:
+            self.db_adapter.get_session().add(obj)
+            return True
+        return self.write_buffer.insert(obj)
+
+    def flush(self) -> bool:
+        """Write out the write-behind buffer, if there is one."""
+        if self.write_buffer is None:
+            return True
+        return self.write_buffer.flush()
+
+    @contextmanager
+    def unit_of_work(self):
+        """Run a block on its own session and commit it on exit, or roll it back on error.
+
+        Every asyncio task and thread gets its own session, so a failing worker
+        only rolls back its own changes. Services called inside the block share
+        the session, nested blocks join the outer one. Rows handed to a
+        write-behind buffer are not part of it and are not rolled back.
+        """
+        outermost = not self.db_adapter.in_session_scope()
+        with self.db_adapter.session_scope() as session:
+            try:
+                yield session
+                if outermost:
+                    session.commit()
+                    self.db_adapter.mark_written()
+            except BaseException:
+                session.rollback()
+                raise
+        if outermost:
+            # buffers do not flush inside a unit of work, they would wait for its locks
+            for write_buffer in list(self.db_adapter.write_buffers):
+                write_buffer.flush_if_due()
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) run in its own unit of work on a DB thread.
+
+        Coroutines use this instead of calling services directly, so the
+        event loop is not blocked while the database works.
+        """
+        def work():
+            with self.unit_of_work():
+                return fn(*args, **kwargs)
+        return await self.db_adapter.executor.run(work)
+
     def count(self):
         """Return the number of items in the database."""
         return self.db_adapter.get_session().query(self.base_type).count()
@@ -46,7 +119,9 @@ class BaseService:
 
         if not verbose:
             self._commit()
+            self.flush()
             return
 
         print("Commiting Service:", self.__class__.__name__)
         self._commit()
+        self.flush()
@@ -1,48 +1,192 @@
+import random
+from collections import namedtuple
+from typing import List
+
+from src.models import PartitionStatsTable, TableStats
 from src.services import BaseService
-from sqlalchemy import func, union_all
+from sqlalchemy import func, or_, select, union_all, update
+
+_row_types = {}
 
 class PartitionedService(BaseService):
     def get_model(self, table_name):
         return self.db_adapter.get_model(table_name, self.base_type)
-    
+
+    def get_partition_models(self, keys=None) -> dict:
+        """Map the partition models to query to the keys each of them holds.
+
+        Keys are values of the partition column, e.g. words of the document
+        index. Only the partitions holding at least one of them are returned,
+        every partition (with None) if no keys are given.
+        """
+        if keys is None:
+            return {
+                self.get_model(f"{self.base_type.__basename__}_{key}"): None
+                for key in self.base_type.partition_keys + ["default"]
+            }
+        plan = {}
+        for key in dict.fromkeys(keys):
+            if key:
+                plan.setdefault(self.base_type.get_partition_tablename(key), []).append(key)
+        return {self.get_model(table_name): table_keys for table_name, table_keys in plan.items()}
+
+    def union_partitions(self, build_query, keys=None):
+        """union_all of build_query(model, keys) over the partitions get_partition_models picks.
+
+        Returns None when no partition can hold any of the keys.
+        """
+        queries = [build_query(model, table_keys) for model, table_keys in self.get_partition_models(keys).items()]
+        if not queries:
+            return None
+        # a union of a single select compiles to the plain select, and keeps
+        # returning column rows instead of ORM entities
+        return union_all(*queries)
+
+    def get_partition_stats(self) -> List[PartitionStatsTable]:
+        """Get the stats rows of every partition."""
+        table_names = [model.__tablename__ for model in self.get_partition_models()]
+        session = self.db_adapter.get_session()
+        return session.query(PartitionStatsTable).filter(PartitionStatsTable.table_name.in_(table_names)).all()
+
+    def stats(self) -> TableStats:
+        """Row, unscanned row and body byte counts over all partitions, read from the stats table."""
+        table_names = [model.__tablename__ for model in self.get_partition_models()]
+        query = (
+            select(
+                func.sum(PartitionStatsTable.row_count),
+                func.sum(PartitionStatsTable.unscanned_count),
+                func.sum(PartitionStatsTable.bytes),
+            )
+            .where(PartitionStatsTable.table_name.in_(table_names))
+        )
+        row_count, unscanned_count, size = self.db_adapter.get_session().execute(query).one()
+        return TableStats(row_count=row_count or 0, unscanned_count=unscanned_count or 0, bytes=size or 0)
+
+    def select_columns(self, model, columns=None):
+        """select() of the given columns of a partition model, of the whole row if columns is None."""
+        if columns is None:
+            return select(model)
+        return select(*(getattr(model, column) for column in columns))
+
+    def fetch_first(self, build_query, limit: int, sort_key, keys=None, columns=None) -> list:
+        """The first `limit` rows over all partitions, in sort_key order.
+
+        build_query(model, keys) has to order its partition the same way and
+        select `columns`, if given. Each partition is cut to `limit` rows in
+        the database, so at most limit * partitions rows are read whatever the
+        size of the tables.
+        """
+        query = self.union_partitions(
+            lambda model, table_keys: select(build_query(model, table_keys).limit(limit).subquery()),
+            keys=keys,
+        )
+        if query is None:
+            return []
+        rows = self.rows_to_tuples(self.db_adapter.get_session().execute(query), columns)
+        rows.sort(key=sort_key)
+        return rows[:limit]
+
+    def sample(self, condition, limit: int, columns=None) -> list:
+        """Up to `limit` random rows matching condition(model), as row tuples.
+
+        Rows get a random crawl_key when they are generated; the sample is the
+        rows with the smallest keys from a random starting point on, wrapping
+        around, which an index on (condition column, crawl_key) serves
+        without reading the backlog. Rows of older versions get their
+        crawl_key when the column is added (see upgrade_table), rows left
+        without one come first once the range wraps. A projection always
+        includes crawl_key.
+        """
+        if columns is not None and "crawl_key" not in columns:
+            columns = (*columns, "crawl_key")
+        start = random.random()
+        rows = self.fetch_first(
+            lambda model, _: (
+                self.select_columns(model, columns)
+                .where(condition(model), model.crawl_key >= start)
+                .order_by(model.crawl_key)
+            ),
+            limit,
+            sort_key=lambda row: row.crawl_key,
+            columns=columns,
+        )
+        if len(rows) < limit:
+            rows += self.fetch_first(
+                lambda model, _: (
+                    self.select_columns(model, columns)
+                    .where(condition(model), or_(model.crawl_key < start, model.crawl_key == None))
+                    .order_by(model.crawl_key)
+                ),
+                limit - len(rows),
+                sort_key=lambda row: (row.crawl_key is not None, row.crawl_key),
+                columns=columns,
+            )
+        return rows
+
+    def update_columns(self, key, **values) -> int:
+        """Set columns of the row whose partition column is `key` with an UPDATE, without loading it.
+
+        Use it to persist changes to the transient objects of to_object.
+        Returns the number of rows changed.
+        """
+        model = self.get_model(self.base_type.get_partition_tablename(key))
+        column = getattr(model, self.base_type.partition_column)
+        return self.db_adapter.get_session().execute(update(model).where(column == key).values(**values)).rowcount
+
     def count(self):
         """Return the number of items in the database across all partitioned tables."""
-        total = 0
-        for key in self.base_type.partition_keys + ["default"]:
-            table_name = f"{self.base_type.__basename__}_{key}"
-            DynamicTable = self.db_adapter.get_model(table_name, self.base_type)
-            stmt = self.db_adapter.get_session().query(func.count()).select_from(DynamicTable)
-            total += stmt.scalar()
-        return total
-    
-    def get_all(self):
-        queries = []
-        for key in self.base_type.partition_keys + ["default"]:
-            table_name = f"{self.base_type.__basename__}_{key}"
-            DynamicTable = self.get_model(table_name)
-            query = self.db_adapter.get_session().query(DynamicTable)
-            queries.append(query)
-        
-        fetch_all_query = union_all(*queries)
-        result = self.db_adapter.get_session().execute(fetch_all_query).fetchall()
-
-        return self.rows_to_objects(result)
+        return self.stats().row_count
+
+    def count_rows(self):
+        """Count the rows with a scan of every partition, for checking the stats table."""
+        query = self.union_partitions(lambda model, _: select(func.count()).select_from(model))
+        return sum(self.db_adapter.get_session().execute(query).scalars())
+
+    def get_all(self, columns=None):
+        query = self.union_partitions(lambda model, _: self.select_columns(model, columns))
+        result = self.db_adapter.get_session().execute(query)
+
+        return self.rows_to_tuples(result, columns)
+
+    def get_row_type(self, columns=None) -> type:
+        """The named tuple type rows of the partitioned table are read into.
+
+        Fields are the given columns, or every column in table order.
+        """
+        key = (self.base_type, tuple(columns) if columns is not None else None)
+        row_type = _row_types.get(key)
+        if row_type is None:
+            if columns is None:
+                model = self.get_model(f"{self.base_type.__basename__}_default")
+                columns = [column.key for column in model.__table__.columns]
+            name = "".join(part.title() for part in self.base_type.__basename__.split("_")) + "Row"
+            row_type = namedtuple(name, columns)
+            _row_types[key] = row_type
+        return row_type
+
+    def rows_to_tuples(self, result, columns=None) -> list:
+        """Read Core result rows into named tuples, without ORM instances or the identity map.
+
+        `columns` has to match what the query selected. Rows are read only;
+        use to_object to change and write one back.
+        """
+        return list(map(self.get_row_type(columns)._make, result))
+
+    def to_object(self, row):
+        """Convert a row tuple into a transient ORM object of the partition it belongs to.
+
+        Columns a projected row lacks stay unset, such an object must not be
+        written back or it clears them.
+        """
+        values = row._asdict()
+        return self.generate_obj(self.base_type.partition_column, **values)
 
     def rows_to_objects(self, result):
-        objects = []
-        for row in result:
-            for key in self.base_type.partition_keys + ["default"]:
-                table_name = f"{self.base_type.__basename__}_{key}"
-                DynamicTable = self.get_model(table_name)
-                obj = DynamicTable()
-                for i, column in enumerate(DynamicTable.__table__.columns):
-                    setattr(obj, column.name, row[i])
-                objects.append(obj)
-                break
-        
-        return objects
+        return [self.to_object(row) for row in self.rows_to_tuples(result)]
 
     def generate_obj(self, partition_key_name, **kwargs):
+        if hasattr(self.base_type, "crawl_key") and kwargs.get("crawl_key") is None:
+            kwargs["crawl_key"] = random.random()
         tablename = self.base_type.get_partition_tablename(kwargs[partition_key_name])
         DynamicTable = self.get_model(tablename)
-        return DynamicTable(**kwargs)
\ No newline at end of file
+        return DynamicTable(**kwargs)
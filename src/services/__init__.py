@@ -4,4 +4,9 @@ from .IPService import IPService
 from .DocumentIndexService import DocumentIndexService
 from .PageService import PageService
 from .URLFrontierService import URLFrontierService
-from .BacklinkService import BacklinkService
\ No newline at end of file
+from .BacklinkService import BacklinkService
+from .BlobService import BlobService
+from .HostService import HostService
+from .ChunkProgressService import ChunkProgressService
+from .LeaseService import LeaseService
+from .FingerprintService import FingerprintService
@@ -1,8 +1,8 @@
 
 import platform
 import subprocess
+import bisect
 import ipaddress
-import pickle
 import json
 
 from src.models.pyd import Config
@@ -34,41 +34,70 @@ def ping(host):
     return subprocess.call(command, stdout=subprocess.DEVNULL) == 0
 
 
-def get_reserved_ips() -> set[ipaddress.IPv4Address]:
-    _reserved_blocks = [
-        (ipaddress.IPv4Network('0.0.0.0/8'),),
-        # (ipaddress.IPv4Network('10.0.0.0/8'),),
-        # (ipaddress.IPv4Network('100.64.0.0/10'),),
-        # (ipaddress.IPv4Network('127.0.0.0/8'),),
-        # (ipaddress.IPv4Network('169.254.0.0/16'),),
-        # (ipaddress.IPv4Network('172.16.0.0/12'),),
-        # (ipaddress.IPv4Network('192.0.0.0/24'),),
-        # (ipaddress.IPv4Network('192.0.2.0/24'),),
-        # (ipaddress.IPv4Network('192.88.99.0/24'),),
-        # (ipaddress.IPv4Network('192.168.0.0/16'),),
-        # (ipaddress.IPv4Network('198.18.0.0/15'),),
-        # (ipaddress.IPv4Network('198.51.100.0/24'),),
-        # (ipaddress.IPv4Network('203.0.113.0/24'),),
-        # (ipaddress.IPv4Network('224.0.0.0/4'),),
-        # (ipaddress.IPv4Network('233.252.0.0/24'),),
-        # (ipaddress.IPv4Network('240.0.0.0/4'),),
-        # (ipaddress.IPv4Network('255.255.255.255/32'),)
-    ]
-    reserved_ips = set()
-    try:
-        print("Trying to load reserved IPs from file...")
-        with open("data/reserved_ips.pkl", "rb") as f:
-            reserved_ips = pickle.load(f)
-            print("Loaded reserved IPs from file")
-            return reserved_ips
-    except FileNotFoundError:
-        print("No reserved IP file found, generating reserved IPs...")
-    
-    for block in _reserved_blocks:
-        print("Processing block:", block)
-        if len(block) != 1 or not isinstance(block[0], ipaddress.IPv4Network):
-            continue
-        reserved_ips.update(set(block[0]))
-    with open("data/reserved_ips.pkl", "wb") as f:
-        pickle.dump(reserved_ips, f)
-    return reserved_ips
\ No newline at end of file
+class IPRangeSet:
+    """Sorted, merged set of inclusive IPv4 integer ranges."""
+    def __init__(self, ranges: list[tuple[int, int]] = None):
+        merged = []
+        for start, end in sorted(ranges or []):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.ranges = merged
+        self._starts = [start for start, _ in merged]
+
+    @classmethod
+    def from_networks(cls, networks: list[str]) -> 'IPRangeSet':
+        ranges = []
+        for network in networks:
+            network = ipaddress.IPv4Network(network, strict=False)
+            ranges.append((int(network.network_address), int(network.broadcast_address)))
+        return cls(ranges)
+
+    def __len__(self) -> int:
+        return len(self.ranges)
+
+    def _find(self, ip: int) -> int:
+        """Index of the range that could contain `ip`, -1 if there is none."""
+        return bisect.bisect_right(self._starts, ip) - 1
+
+    def contains(self, ip: int | str) -> bool:
+        if isinstance(ip, str):
+            ip = int(ipaddress.IPv4Address(ip))
+        i = self._find(ip)
+        return i >= 0 and ip <= self.ranges[i][1]
+
+    def covers(self, start: int, end: int) -> bool:
+        """True if every address in [start, end] is inside a single range."""
+        i = self._find(start)
+        return i >= 0 and end <= self.ranges[i][1]
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """True if any address in [start, end] is inside the set."""
+        i = self._find(end)
+        return i >= 0 and self.ranges[i][1] >= start
+
+
+reserved_networks = [
+    '0.0.0.0/8',
+    '10.0.0.0/8',
+    '100.64.0.0/10',
+    '127.0.0.0/8',
+    '169.254.0.0/16',
+    '172.16.0.0/12',
+    '192.0.0.0/24',
+    '192.0.2.0/24',
+    '192.88.99.0/24',
+    '192.168.0.0/16',
+    '198.18.0.0/15',
+    '198.51.100.0/24',
+    '203.0.113.0/24',
+    '224.0.0.0/4',
+    '233.252.0.0/24',
+    '240.0.0.0/4',
+    '255.255.255.255/32',
+]
+
+def get_excluded_ranges(blocklist: list[str] = None) -> IPRangeSet:
+    """Return the reserved IPv4 networks plus the user supplied blocklist as merged integer ranges."""
+    return IPRangeSet.from_networks(reserved_networks + list(blocklist or []))
@@ -3,7 +3,7 @@ import sys
 import os
 import threading
 
-from src.exceptions import InvalidResponse
+from src.exceptions import InvalidResponse, ResponseRejected
 from src.models import URLFrontierTable
 from src.services import URLFrontierService
 from src.utils import config
@@ -18,6 +18,7 @@ from src.services.IPService import IPService
 from sqlalchemy.exc import SQLAlchemyError
 
 from src.modules.response_validator import ResponseValidator
+from src.modules.url_canonicalizer import URLCanonicalizer
 from urllib.parse import urlparse
 
 def get_base_url(url):
@@ -25,6 +26,23 @@ def get_base_url(url):
     parsed = urlparse(url)
     return parsed.scheme + "://" + parsed.netloc
 
+def store_ip(url: str, response, ip, port: int):
+    """Add the IP a frontier url answered from and take the url off the frontier."""
+    obj = ip_service.generate_obj(
+        "domain",
+        domain=url_canonicalizer.origin(response.url) or response.url,
+        ip=ip,
+        port=port,
+        status=response.status_code,
+    )
+    # existing IPs are skipped when the buffer is written
+    is_added = ip_service.buffer_insert(obj)
+    if is_added:
+        print(f"✅ - Append to IPs - {obj.domain} - ({ip}:{port}) - [{obj.status}] - added to the IP buffer.")
+    
+    url_frontier_service.delete_url(url)
+    print(f"🧹 - Cleanup - {url} removed from the URL frontier.")
+
 async def url_frontier_scan_task(url_obj: URLFrontierTable, semaphore):
     async with semaphore, aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=config.crawler.req_timeout)) as session:
         try:
@@ -43,24 +61,17 @@ async def url_frontier_scan_task(url_obj: URLFrontierTable, semaphore):
                 "User-Agent": config.crawler.user_agent,
             }
             async with session.get(base_url, headers=headers) as response:
-                response = await ResponseConverter.from_aiohttp(response)
-                fails = validator.validate(response)
+                status = response.status
+                try:
+                    response = await ResponseConverter.from_aiohttp(response, validator=header_validator)
+                except ResponseRejected as e:
+                    raise InvalidResponse(f"[{status}] {e}") from e
+                fails = validator.validate(response, headers_checked=config.crawler.header_prefilter)
                 if fails:
-                    raise InvalidResponse("Response failed validation")
-
-                obj = ip_service.generate_obj(
-                    "domain",
-                    domain=response.url,
-                    ip=ip,
-                    port=port,
-                    status=response.status_code,
-                )
-                is_added = ip_service.safe_add_url(obj)
-                if is_added:
-                    print(f"✅ - Append to IPs - {obj.domain} - ({ip}:{port}) - [{obj.status}] - added to IP table session.")
-                
-                url_frontier_service.delete_url(url_obj.url)
-                print(f"🧹 - Cleanup - {url_obj.url} removed from the URL frontier.")
+                    raise InvalidResponse(f"[{response.status_code}] {[fail.name for fail in fails]}")
+
+                # runs on the DB thread, the other fetches go on meanwhile
+                await url_frontier_service.run(store_ip, url_obj.url, response, ip, port)
         except (
             SQLAlchemyError,
             aiohttp.ClientConnectorError,
@@ -73,15 +84,14 @@ async def url_frontier_scan_task(url_obj: URLFrontierTable, semaphore):
             ):
             # TODO maybe implement error counter and timeout?
             print(f"❌ - General Error - Removing {url_obj.url} from URL Frontier due to error")
-            url_frontier_service.delete_url(url_obj.url)
-        except InvalidResponse:
-            print(f"❌ - Validation Error - {response.url} ({ip}) [{response.status_code}] - {[fail.name for fail in fails]}")
-            url_frontier_service.delete_url(url_obj.url)
+            await url_frontier_service.run(url_frontier_service.delete_url, url_obj.url)
+        except InvalidResponse as e:
+            print(f"❌ - Validation Error - {url_obj.url} ({ip}) - {e.__class__.__name__}: {e}")
+            await url_frontier_service.run(url_frontier_service.delete_url, url_obj.url)
         except KeyboardInterrupt:
             raise KeyboardInterrupt
         except (Exception) as e:
             print("CRITICAL ERROR:", e.__class__.__name__, e)
-            url_frontier_service.db_adapter.get_session().rollback()
 
 async def url_frontier_task_generator(semaphore, limit=500):
     tasks = []
@@ -95,8 +105,11 @@ async def url_frontier_task_generator(semaphore, limit=500):
 
 
 validator = ResponseValidator()
+header_validator = validator if config.crawler.header_prefilter else None
+url_canonicalizer = URLCanonicalizer(config.crawler)
 db_adapter = load_db_adapter()
 ip_service = IPService(db_adapter)
+ip_service.enable_write_behind()
 url_frontier_service = URLFrontierService(db_adapter)
 
 print("Initial URL Frontier size:", url_frontier_service.count())